@@ -8,17 +8,53 @@ Nikki Hess (nkhess@umich.edu)
 """
 
 # built-in
-import json
+import functools
+import queue
+import threading
 
 # pypi
 import boto3
+from botocore.config import Config
+import orjson
 
 # my modules
 from nikki_utils import tsprint
 from . import config
 
-LATEST_MESSAGE = None # latest SQS message
-STOP_THREAD = False
+SQS_QUEUE_URL = "https://sqs.us-east-2.amazonaws.com/225753854445/slackLambda-dev.fifo"
+
+MESSAGE_QUEUE = queue.Queue(maxsize=128) # SQS replies waiting for the GUI
+
+# dumping full payloads/responses means formatting them on every call,
+# so only do it when debugging
+LOG_PAYLOADS = False
+
+# pre-serialized payload skeletons, only the (JSON-encoded) variable fields get filled in per call
+POST_PAYLOAD_TEMPLATE = b'{"body":{"type":"post","message":%b,"channel_id":%b,"device_id":%b}}'
+EDIT_PAYLOAD_TEMPLATE = b'{"body":{"type":%b,"message_id":%b,"channel_id":%b}}'
+
+# keepalive holds connections open between sporadic presses so we skip the TLS handshake
+# invoking posts to Slack, so the Lambda client never retries: a retry after a read timeout
+# would post the same message twice, where failing just lets the user press again
+LAMBDA_CLIENT_CONFIG = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    connect_timeout=2,
+    retries={"total_max_attempts": 1, "mode": "standard"}
+)
+
+# receives and deletes are safe to repeat, so the SQS client retries throttles,
+# read_timeout has to stay above the 20s SQS long poll
+SQS_CLIENT_CONFIG = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    connect_timeout=2,
+    read_timeout=30,
+    retries={"max_attempts": 3, "mode": "adaptive"}
+)
+
+# (access key, region) -> (lambda_client, sqs_client)
+CLIENT_CACHE = {}
 
 def post_to_slack(aws_client: boto3.client, message: str, channel_id: str,
                   device_id: str, dev: bool):
@@ -43,17 +79,15 @@ def post_to_slack(aws_client: boto3.client, message: str, channel_id: str,
 
     tsprint("Posting message to Slack via AWS.")
 
-    payload = {
-        "body": {
-            "type": "post",
-            "message": message,
-            "channel_id": channel_id,
-            "device_id": device_id
-        }
-    }
-    payload = json.dumps(payload) # convert dict to string
+    # bytes, boto3 accepts these as-is
+    payload = POST_PAYLOAD_TEMPLATE % (
+        orjson.dumps(message),
+        orjson.dumps(channel_id),
+        orjson.dumps(device_id)
+    )
 
-    tsprint(f"AWS Payload: {payload}")
+    if LOG_PAYLOADS:
+        tsprint(f"AWS Payload: {payload}")
 
     # the function name is apparently the name of the instance ¯\_(ツ)_/¯
     response = aws_client.invoke(
@@ -61,11 +95,11 @@ def post_to_slack(aws_client: boto3.client, message: str, channel_id: str,
         Payload=payload
     )
 
-    # extract our custom response
-    response = response["Payload"].read().decode("utf-8")
-    response = json.loads(response)
+    # extract our custom response, orjson parses the raw bytes directly
+    response = orjson.loads(response["Payload"].read())
 
-    tsprint(f"AWS Response: {response}")
+    if LOG_PAYLOADS:
+        tsprint(f"AWS Response: {response}")
 
     # this should be guaranteed with a post payload
     return response.get("posted_message_id"), response.get("posted_message_channel")
@@ -83,34 +117,31 @@ def mark_message_timed_out(aws_client: boto3.client, message_id: str, channel_id
     :param dev: whether we're using the dev AWS instance
     :type dev: bool
 
-    :return response: the AWS response payload
+    :return response: the raw invoke response (StatusCode 202 once queued)
     :rtype: dict
     """
     tsprint(f"Marking message {message_id} as timed out.")
 
-    payload = {
-        "body": {
-            "type": "message_timeout",
-            "message_id": message_id,
-            "channel_id": channel_id
-        }
-    }
-    payload = json.dumps(payload) # convert dict to string
+    # bytes, boto3 accepts these as-is
+    payload = EDIT_PAYLOAD_TEMPLATE % (
+        b'"message_timeout"',
+        orjson.dumps(message_id),
+        orjson.dumps(channel_id)
+    )
 
-    tsprint(f"AWS Payload: {payload}")
+    if LOG_PAYLOADS:
+        tsprint(f"AWS Payload: {payload}")
 
-    # invoke the AWS Lambda function
+    # invoke the AWS Lambda function asynchronously, nothing downstream
+    # needs the edit result so there's no reason to wait for Slack
     response = aws_client.invoke(
         FunctionName="slackLambda-dev" if dev else "slackLambda",
+        InvocationType="Event",
         Payload=payload
     )
-    
-    # extract our custom response
-    response = response["Payload"].read().decode("utf-8")
-    response = json.loads(response)
-    
-    tsprint(f"AWS Response: {response}")
-    
+
+    tsprint(f"AWS invoke queued with status {response.get('StatusCode')}")
+
     return response
 
 def mark_message_replied(aws_client: boto3.client, message_id: str, channel_id: str, dev: bool) -> dict:
@@ -126,37 +157,34 @@ def mark_message_replied(aws_client: boto3.client, message_id: str, channel_id:
     :param dev: whether we're using the dev AWS instance
     :type dev: bool
 
-    :return response: the AWS response payload
+    :return response: the raw invoke response (StatusCode 202 once queued)
     :rtype: dict
     """
     tsprint(f"Marking message {message_id} as replied.")
 
-    payload = {
-        "body": {
-            "type": "message_replied",
-            "message_id": message_id,
-            "channel_id": channel_id
-        }
-    }
-    payload = json.dumps(payload) # convert dict to string
+    # bytes, boto3 accepts these as-is
+    payload = EDIT_PAYLOAD_TEMPLATE % (
+        b'"message_replied"',
+        orjson.dumps(message_id),
+        orjson.dumps(channel_id)
+    )
 
-    tsprint(f"AWS Payload: {payload}")
+    if LOG_PAYLOADS:
+        tsprint(f"AWS Payload: {payload}")
 
-    # invoke the AWS Lambda function
+    # invoke the AWS Lambda function asynchronously, nothing downstream
+    # needs the edit result so there's no reason to wait for Slack
     response = aws_client.invoke(
         FunctionName="slackLambda-dev" if dev else "slackLambda",
+        InvocationType="Event",
         Payload=payload
     )
 
-    # extract our custom response
-    response = response["Payload"].read().decode("utf-8")
-    response = json.loads(response)
-    
-    tsprint(f"AWS Response: {response}")
+    tsprint(f"AWS invoke queued with status {response.get('StatusCode')}")
 
     return response
 
-def poll_sqs(sqs_client: boto3.client, device_id: str):
+def poll_sqs(sqs_client: boto3.client, device_id: str, stop_event: threading.Event, on_message=None):
     """
     Periodically polls SQS, will run on a separate thread
 
@@ -164,46 +192,107 @@ def poll_sqs(sqs_client: boto3.client, device_id: str):
     :type sqs_client: boto3.client
     :param device_id: the id of the device we're on
     :type device_id: str
+    :param stop_event: set to stop this poll loop, each loop needs its own
+    :type stop_event: threading.Event
+    :param on_message: called with no arguments whenever new replies land in MESSAGE_QUEUE
+    :type on_message: Callable[[], None] | None
     """
-    global LATEST_MESSAGE, STOP_THREAD
-
     tsprint(f"Starting SQS poll loop for device {device_id}")
-    queue_url = "https://sqs.us-east-2.amazonaws.com/225753854445/slackLambda-dev.fifo"
+
+    # bind the constant arguments once instead of rebuilding them every loop
+    # long-poll for up to 10 messages at once, SQS holds the request
+    # open until something arrives (or 20s pass) so we don't hammer AWS
+    receive_messages = functools.partial(
+        sqs_client.receive_message,
+        QueueUrl=SQS_QUEUE_URL,
+        MaxNumberOfMessages=10,
+        WaitTimeSeconds=20
+    )
+    delete_messages = functools.partial(sqs_client.delete_message_batch, QueueUrl=SQS_QUEUE_URL)
 
     while True:
-        if STOP_THREAD:
+        if stop_event.is_set():
             tsprint("Stopping SQS poll loop.")
-            STOP_THREAD = False
             break
 
-        response = sqs_client.receive_message(
-            QueueUrl=queue_url,
-            MaxNumberOfMessages=1,
-            WaitTimeSeconds=3 # no hammering AWS >:(
-        )
+        response = receive_messages()
 
         # has to be obtained as a list first
         messages = response.get("Messages", [])
 
         if messages:
-            message = messages[0] # get the first item
+            queued = False
+            for message in messages:
+                # process the message
+                # with raw message delivery on the SNS subscription the body
+                # is already our message, otherwise unwrap the SNS envelope
+                message_body = orjson.loads(message["Body"])
+                if "Message" in message_body:
+                    message_body = orjson.loads(message_body["Message"])
+
+                tsprint(f"SQS message received: {message_body}")
+                if "reply_text" in message_body:
+                    try:
+                        MESSAGE_QUEUE.put_nowait(message_body)
+                        queued = True
+                    except queue.Full:
+                        tsprint("WARNING: SQS message queue is full. Dropping message.")
+
+            # delete the whole batch from the queue after processing
+            entries = [
+                {"Id": str(i), "ReceiptHandle": message["ReceiptHandle"]}
+                for i, message in enumerate(messages)
+            ]
+            failed = delete_messages(Entries=entries).get("Failed", [])
+
+            # anything left undeleted comes back once its visibility timeout runs out,
+            # and would be handed to the GUI again, so give those one more go
+            if failed:
+                failed_ids = {failure["Id"] for failure in failed}
+                failed = delete_messages(
+                    Entries=[entry for entry in entries if entry["Id"] in failed_ids]
+                ).get("Failed", [])
+
+            for failure in failed:
+                tsprint(f"WARNING: Could not delete SQS message {failure['Id']}: {failure.get('Code')} {failure.get('Message')}")
+
+            tsprint(f"Deleted {len(messages) - len(failed)} SQS message(s) from queue.")
+
+            # let the consumer know right away instead of waiting for it to check
+            if queued and on_message is not None:
+                on_message()
+
+def start_polling(sqs_client: boto3.client, device_id: str, on_message=None) -> threading.Event:
+    """
+    Starts polling SQS on a new daemon thread
+
+    :param sqs_client: the SQS client we're using
+    :type sqs_client: boto3.client
+    :param device_id: the id of the device we're on
+    :type device_id: str
+    :param on_message: called with no arguments whenever new replies land in MESSAGE_QUEUE
+    :type on_message: Callable[[], None] | None
 
-            # process the message
-            message_body = message["Body"]
-            message_body = json.loads(message_body) # load into JSON
-            message_body = message_body["Message"] # get message
-            message_body = json.loads(message_body) # load into JSON again
+    :return: the poll loop's own stop event, to pass to stop_polling
+    :rtype: threading.Event
+    """
+    # a loop still finishing its long poll can't see (or clear) a newer loop's event
+    stop_event = threading.Event()
+
+    threading.Thread(target=poll_sqs,
+                     args=[sqs_client, device_id, stop_event, on_message],
+                     daemon=True).start()
 
-            tsprint(f"SQS message received: {message_body}")
-            if "reply_text" in message_body.keys():
-                LATEST_MESSAGE = message_body
+    return stop_event
 
-            # delete from queue after process
-            sqs_client.delete_message(
-                QueueUrl=queue_url,
-                ReceiptHandle=message["ReceiptHandle"]
-            )
-            tsprint("Deleted SQS message from queue.")
+def stop_polling(stop_event: threading.Event) -> None:
+    """
+    Tells an SQS poll loop to stop, it exits once any in-flight long poll returns
+
+    :param stop_event: the stop event start_polling returned
+    :type stop_event: threading.Event
+    """
+    stop_event.set()
 
 def setup_aws() -> boto3.client:
     """
@@ -214,32 +303,37 @@ def setup_aws() -> boto3.client:
     """
     tsprint("Setting up AWS.")
 
-    global AWS_CONFIG, SLACK_CONFIG, SQS_CLIENT
+    global AWS_CONFIG, SQS_CLIENT
 
     AWS_CONFIG = config.get_and_verify_config_data(config_path="config/aws.json")
-    SLACK_CONFIG = config.get_and_verify_config_data(config_path="config/slack.json")
 
     access_key = AWS_CONFIG["aws_access_key"]
     secret = AWS_CONFIG["aws_secret"]
     region = AWS_CONFIG["region"]
 
-    # set up lambda client
-    client = boto3.client(
-        "lambda",
+    # reuse the clients (and their connection pools) if we've already made them
+    cached_clients = CLIENT_CACHE.get((access_key, region))
+    if cached_clients:
+        tsprint("AWS clients already set-up. Returning cached clients.")
+        SQS_CLIENT = cached_clients[1]
+        return cached_clients
+
+    # one session for both clients, so credentials only resolve once
+    session = boto3.session.Session(
         aws_access_key_id=access_key,
         aws_secret_access_key=secret,
         region_name=region
     )
 
+    # set up lambda client
+    client = session.client("lambda", config=LAMBDA_CLIENT_CONFIG)
+
     # set up sqs client
-    SQS_CLIENT = boto3.client(
-        "sqs",
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret,
-        region_name=region
-    )
+    SQS_CLIENT = session.client("sqs", config=SQS_CLIENT_CONFIG)
+
+    CLIENT_CACHE[(access_key, region)] = (client, SQS_CLIENT)
 
     tsprint("AWS successfully set-up.")
     tsprint("Returning AWS clients.")
 
-    return client, SQS_CLIENT
\ No newline at end of file
+    return client, SQS_CLIENT
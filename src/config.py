@@ -7,13 +7,35 @@ Nikki Hess (nkhess@umich.edh)
 
 # built-in
 from pathlib import Path
-import os
-import json
+import copy
+import functools
+
+# pypi
+import orjson
 
 # my modules
 from nikki_utils import tsprint
 
 CONFIG_DEFAULTS_PATH = "config_defaults"
+CONFIG_CACHE = {} # config path -> (mtime when read, verified config data)
+
+@functools.lru_cache(maxsize=None)
+def get_config_defaults(config_name: str) -> tuple[bytes, dict] | None:
+    """
+    Reads and parses the defaults for a config at most once per process.
+
+	:param config_name: the file name of the config, e.g. "aws.json"
+	:type config_name: str
+
+	:return: a tuple of (raw defaults, parsed defaults), or None if there are no defaults
+	:rtype: (bytes, dict) | None
+    """
+    config_defaults = Path(CONFIG_DEFAULTS_PATH, config_name)
+    if not config_defaults.exists():
+        return None
+
+    config_defaults_raw = config_defaults.read_bytes()
+    return config_defaults_raw, orjson.loads(config_defaults_raw)
 
 def get_and_verify_config_data(config_path: str, create_file: bool = True) -> dict:
     """
@@ -25,16 +47,28 @@ def get_and_verify_config_data(config_path: str, create_file: bool = True) -> di
 	:param create_file: whether to create the file if it doesn't exist. default = True
 	:type create_file: bool
 
-	:return: the config's data
+	:return: the config's data, a copy the caller is free to change
 	:rtype: dict
     """
     config_file = Path(config_path)
+
+    # a stat is much cheaper than reading and parsing, so only do that if the file changed
+    # taken before the read, so a write that lands mid-read is picked up next time
+    try:
+        config_mtime = config_file.stat().st_mtime
+    except FileNotFoundError:
+        config_mtime = None
+
+    cached = CONFIG_CACHE.get(config_path)
+    if cached is not None and cached[0] == config_mtime:
+        # so one caller's changes can't leak into everyone else's config
+        return copy.deepcopy(cached[1])
+
     tsprint(f'Getting/verifying config data for "{config_file.name}"')
 
     # get defaults from {config defaults path}/{config name}
-    config_defaults_path = os.path.join(CONFIG_DEFAULTS_PATH, config_file.name)
-    config_defaults = Path(config_defaults_path)
-    if not config_defaults.exists():
+    config_defaults = get_config_defaults(config_file.name)
+    if config_defaults is None:
         # only require defaults if we're creating a file
         if create_file:
             tsprint(f'ERROR: Defaults did not exist for "{config_file.name}". Turn off create_file or verify the defaults exist.')
@@ -42,20 +76,23 @@ def get_and_verify_config_data(config_path: str, create_file: bool = True) -> di
         
         # if not creating a file, just warn
         tsprint(f'WARNING: Defaults did not exist for "{config_file.name}". Assuming they are not needed.')
-        config_defaults = None
 
-    if create_file:
+    # only touch a missing file, touching an existing one bumps its mtime past the one we cached
+    if create_file and config_mtime is None:
         config_file.parent.mkdir(parents=True, exist_ok=True) # make parent directory if needed
         config_file.touch(exist_ok=True) # make the file if needed
 
+    # read once, the same bytes serve the empty check and the parse
+    config_raw = config_file.read_bytes()
+
     # check for empty config file
-    if os.stat(config_file).st_size == 0:
+    if not config_raw:
         tsprint(f'ERROR: Config file "{config_file.name}" was empty.')
 
         # write defaults if necessary
         if create_file:
             tsprint(f'Writing config defaults to "{config_file.name}"')
-            config_file.write_text(config_defaults.read_text()) # could use json module, but this is easier
+            config_file.write_bytes(config_defaults[0]) # could use json module, but this is easier
         
         tsprint(f'Please populate "{config_file.name} before running again.')
 
@@ -63,16 +100,16 @@ def get_and_verify_config_data(config_path: str, create_file: bool = True) -> di
 
     # check for malformed JSON
     try:
-        config_data: dict = json.loads(config_file.read_text())
-    except json.JSONDecodeError as e:
+        config_data: dict = orjson.loads(config_raw)
+    except orjson.JSONDecodeError as e:
         tsprint(f'Config JSON was malformed for "{config_file.name}"')
         exit(1)
 
     # check for missing fields
     if create_file:
         tsprint(f'Checking for missing fields in config "{config_file.name}" from defaults.')
-        config_defaults_data: dict = json.loads(config_defaults.read_text())
-        missing_fields = [key for key in config_defaults_data.keys() if key not in config_data]
+        config_defaults_data: dict = config_defaults[1]
+        missing_fields = [key for key in config_defaults_data if key not in config_data]
         if missing_fields:
             missing_fields_str = ", ".join(missing_fields)
             tsprint(f'Required fields were missing in "{config_file.name}": {missing_fields_str}')
@@ -81,4 +118,5 @@ def get_and_verify_config_data(config_path: str, create_file: bool = True) -> di
         tsprint("No missing fields found. Proceeding.")
 
     tsprint(f'Config file "{config_file.name}" loaded successfully.')
-    return config_data
\ No newline at end of file
+    CONFIG_CACHE[config_path] = (config_mtime, config_data)
+    return copy.deepcopy(config_data)
\ No newline at end of file
@@ -8,12 +8,17 @@ Nikki Hess - nkhess@umich.edu
 """
 
 # built-in
+import atexit
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+import functools
 import time
 import threading
+import traceback
 import tkinter as tk
 from tkinter import ttk
 import tkinter.font as tkFont
+import queue
 import re
 import sys
 
@@ -25,24 +30,51 @@ from . import slack
 from nikki_utils import tsprint, set_log_file
 
 # pypi
-from PIL import Image, ImageTk
+from PIL import GifImagePlugin, Image, ImageTk
+
+# keep GIF frames paletted for as long as the palette doesn't change,
+# PIL's default switches to RGB(A) after the first frame
+GifImagePlugin.LOADING_STRATEGY = GifImagePlugin.LoadingStrategy.RGB_AFTER_DIFFERENT_PALETTE_ONLY
 
 # constants
 MAIZE = "#FFCB05"
 BLUE = "#00274C"
 
 # globals for state
-pending_message_ids = []  # pending messages from this device specifically
+pending_message_ids = set()  # pending messages from this device specifically
+current_message_id = None    # the message posted by the latest interaction
 message_to_channel = {}   # maps message ids to channel ids
 pending_message_ids_lock = threading.Lock()
 
-frames = []
-frames_ready = False
-frames_lock = threading.Lock()
+# background threads never touch Tk directly, they hand callables to this
+# queue and the main thread runs them from drain_ui_queue
+UI_QUEUE = queue.Queue()
+UI_DRAIN_MS = 16
+
+# replies/reactions containing any of these emoji resolve the request
+RESOLUTION_EMOJIS = frozenset({"white_check_mark", "+1"})
+# emoji names, either :wrapped: in reply text or bare as reaction names (e.g. "+1::skin-tone-2")
+EMOJI_PATTERN = re.compile(r"(?:^|:)([a-z0-9_+'-]+)(?=:|$)")
+
+# one small pool for all the short network calls instead of a thread each
+IO_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="slb-io")
+
+ANIMATION_PATH = "images/custom-animation-fix-pi-size.gif"
+ANIMATION_FPS = 50
+ANIMATION_TICK_MS = 16 # how often we check whether the frame should change
+FRAMES = None # FrameSource for the idle animation, set up in display_gui
+ANIMATION_AFTER_ID = None # the pending animation tick, if any
+COUNTDOWN_AFTER_ID = None # the pending post-interaction countdown tick, if any
+POLL_STOP_EVENT = None # stops the current screen's SQS poll loop, if any
+REPLY_HANDLER = None # handles SQS replies for the current screen, if it takes them
+MAIN_WIDGETS = {} # the main screen's labels, kept around between interactions
 
 SHEETS_SERVICE, SHEETS_SPREADSHEET_ID, SHEETS_TABS = None, None, None
+SHEETS_LOGGER = None # batches rows bound for the logging tab, set up in main
+DEVICE_CONFIG = None # the device config fetched for the latest interaction
 
 FONTS = None
+SCREEN_WIDTH = None # fullscreen, so this can't change once display_gui sets it
 
 # audio globals (will be initialized in main)
 is_simpleaudio_installed = False
@@ -73,37 +105,202 @@ def preload_fonts() -> dict:
     return fonts
 
 
-def preload_frames_lazy():
+class FrameSource:
     """
-    Preloads and caches images lazily.
-    First frame available immediately, others load in the background.
+    Decodes frames of an animated GIF on demand, only keeping the
+    most recently used ones in memory.
     """
-    global frames, frames_ready
 
-    frame_count = 149
+    def __init__(self, path: str, cache_size: int = 16):
+        """
+        :param path: the path of the GIF to decode frames from
+        :type path: str
+
+        :param cache_size: how many decoded frames to keep around
+        :type cache_size: int
+        """
+        self.gif = Image.open(path)
+        self.count = getattr(self.gif, "n_frames", 1)
+        self.size = self.gif.size
+        self.pixels = self.size[0] * self.size[1]
+        self.lock = threading.Lock() # the GIF handle can only seek one frame at a time
+        self.master = None # the Tk root frames belong to, set once the window exists
+
+        # every frame decoded once into one contiguous buffer, see load_filmstrip
+        # paletted (1 byte per pixel) when every frame shares a palette, RGBA otherwise
+        # never mutated after filmstrip_ready is set, so readers don't need the lock
+        self.filmstrip = None
+        self.filmstrip_mode = None
+        self.frame_bytes = None
+        self.palette = None
+        self.transparency = None
+        self.filmstrip_ready = threading.Event()
+
+        # per-instance cache so frames die with the source
+        self.get = functools.lru_cache(maxsize=cache_size)(self.decode)
+
+    def load_filmstrip(self) -> None:
+        """
+        Runs the GIF through PIL's decode pipeline exactly once, storing every
+        frame in the filmstrip. Slow, so meant to run on a background thread.
+        """
+        filmstrip = self.decode_paletted()
+        mode = "P"
+
+        if filmstrip is None:
+            tsprint("Animation GIF frames don't share a palette, decoding to RGBA instead.")
+            filmstrip = self.decode_rgba()
+            mode = "RGBA"
+
+        self.frame_bytes = len(filmstrip) // self.count
+        self.filmstrip_mode = mode
+        self.filmstrip = filmstrip
+        self.filmstrip_ready.set()
+
+        # everything we need is in the filmstrip now
+        with self.lock:
+            self.gif.close()
+
+        tsprint(f"Animation GIF decoded into {mode} filmstrip ({len(filmstrip)} bytes).")
+
+    def decode_paletted(self) -> bytearray | None:
+        """
+        Decodes every frame as palette indices, a quarter of the size of RGBA
+
+        :return: the filmstrip, or None if the frames don't all share one palette
+        :rtype: bytearray | None
+        """
+        filmstrip = bytearray(self.pixels * self.count)
+
+        for index in range(self.count):
+            offset = index * self.pixels
+
+            # only hold the lock per frame so the animation can keep decoding meanwhile
+            with self.lock:
+                self.gif.seek(index)
+                if self.gif.mode != "P":
+                    return None
+
+                palette = self.gif.getpalette()
+                transparency = self.gif.info.get("transparency")
+                if index == 0:
+                    self.palette, self.transparency = palette, transparency
+                elif (palette, transparency) != (self.palette, self.transparency):
+                    return None
+
+                filmstrip[offset:offset + self.pixels] = self.gif.tobytes()
+
+        return filmstrip
+
+    def decode_rgba(self) -> bytearray:
+        """
+        Decodes every frame as RGBA
+
+        :return: the filmstrip
+        :rtype: bytearray
+        """
+        frame_bytes = self.pixels * 4
+        filmstrip = bytearray(frame_bytes * self.count)
+
+        for index in range(self.count):
+            offset = index * frame_bytes
+
+            with self.lock:
+                self.gif.seek(index)
+                filmstrip[offset:offset + frame_bytes] = self.gif.convert("RGBA").tobytes()
+
+        return filmstrip
+
+    def decode(self, index: int) -> ImageTk.PhotoImage:
+        """
+        Decodes a single frame, use get() to go through the cache.
+        Creates a Tk image, so only call this from the main thread
+
+        :param index: the frame to decode
+        :type index: int
+
+        :return: the decoded frame
+        :rtype: ImageTk.PhotoImage
+        """
+        if not self.filmstrip_ready.is_set():
+            with self.lock:
+                # checked again now that we hold the lock, the filmstrip may have
+                # finished (and the GIF been closed) while we were waiting for it
+                if not self.filmstrip_ready.is_set():
+                    self.gif.seek(index)
+                    return ImageTk.PhotoImage(self.gif.convert("RGBA"), master=self.master)
+
+        # zero-copy view of this frame's slice of the filmstrip
+        offset = index * self.frame_bytes
+        frame_view = memoryview(self.filmstrip)[offset:offset + self.frame_bytes]
+        frame = Image.frombuffer(self.filmstrip_mode, self.size, frame_view,
+                                 "raw", self.filmstrip_mode, 0, 1)
+
+        # PhotoImage would drop the transparency of a paletted image
+        if self.filmstrip_mode == "P":
+            frame.putpalette(self.palette)
+            if self.transparency is not None:
+                frame.info["transparency"] = self.transparency
+            frame = frame.convert("RGBA")
+
+        return ImageTk.PhotoImage(frame, master=self.master)
+
+
+def is_resolution(reply_text: str) -> bool:
+    """
+    Checks whether a reply or reaction contains a resolving emoji
 
-    with Image.open("images/custom-animation-fix-pi-size.gif") as gif:
-        gif.seek(0)
-        with frames_lock: # lock to prevent race conditions (not guaranteed)
-            frames.append(ImageTk.PhotoImage(gif.copy()))
-    tsprint("Preloaded first animation frame.")
-    tsprint("Starting lazy background loader thread.")
+    :param reply_text: the reply text or reaction name from SQS
+    :type reply_text: str
 
-    def worker():
-        global frames_ready
-        with Image.open("images/custom-animation-fix-pi-size.gif") as gif:
-            for i in range(1, frame_count):
-                try:
-                    gif.seek(i)
-                    with frames_lock: # lock in case of race conditions (not guaranteed)
-                        frames.append(ImageTk.PhotoImage(gif.copy()))
-                except EOFError:
-                    # if we can't load any more frames, get outta here
-                    break
-            tsprint("Custom animation GIF background frames loaded!")
-            frames_ready = True
+    :return: whether the request should be considered resolved
+    :rtype: bool
+    """
+    return not RESOLUTION_EMOJIS.isdisjoint(EMOJI_PATTERN.findall(reply_text))
+
+def log_io_error(future: Future) -> None:
+    """
+    Logs the exception from a finished IO_POOL task, if any, since
+    the pool would otherwise swallow it
+
+    :param future: the finished task
+    :type future: Future
+    """
+    # dropped on exit, see exit_gui
+    if future.cancelled():
+        return
+
+    error = future.exception()
+    if error is not None:
+        tsprint(f"ERROR: Background task failed:\n{error!r}")
+
+def submit_io(fn, *args) -> Future:
+    """
+    Runs fn(*args) on IO_POOL
+
+    :param fn: the function to run
+    :type fn: Callable
 
-    threading.Thread(target=worker, daemon=True).start()
+    :return: the submitted task
+    :rtype: Future
+    """
+    future = IO_POOL.submit(fn, *args)
+    future.add_done_callback(log_io_error)
+
+    return future
+
+def preload_frames_lazy():
+    """
+    Opens the animation GIF so that frames can be decoded lazily, as they're shown.
+    The full filmstrip is decoded in the background.
+    """
+    global FRAMES
+
+    FRAMES = FrameSource(ANIMATION_PATH)
+    tsprint(f"Opened animation GIF with {FRAMES.count} frames.")
+
+    tsprint("Starting background filmstrip decode thread.")
+    threading.Thread(target=FRAMES.load_filmstrip, daemon=True).start()
 
 
 def bind_presses(root: tk.Tk, frame: tk.Frame, style: ttk.Style, do_post: bool) -> None:
@@ -143,40 +340,51 @@ def display_main(frame: tk.Frame, style: ttk.Style) -> None:
     """
 
     def load_contents():
-        style.configure("NeedHelp.TLabel", foreground=MAIZE, background=BLUE, font=FONTS["oswald_96"])
-        style.configure("Instructions.TLabel", foreground=MAIZE, background=BLUE, font=FONTS["oswald_80"])
-
-        dude_img_label = ttk.Label(frame, image=frames[0], background=BLUE)
+        global ANIMATION_AFTER_ID
+
+        # the main screen's labels are built once and just re-placed afterwards
+        if not MAIN_WIDGETS:
+            MAIN_WIDGETS["dude"] = ttk.Label(frame, background=BLUE)
+            MAIN_WIDGETS["instructions"] = ttk.Label(frame, text="Tap the screen!",
+                                                    style="Instructions.TLabel")
+            # help label has to be created after img to be seen (layering)
+            MAIN_WIDGETS["help"] = ttk.Label(frame, text="Need help?", style="NeedHelp.TLabel")
+
+        dude_img_label = MAIN_WIDGETS["dude"]
+        dude_img_label.configure(image=FRAMES.get(0))
         dude_img_label.place(relx=0.5, rely=0.34, anchor="center")
 
-        frame_count = len(frames)
+        # a previous animation may still be running on the same label
+        if ANIMATION_AFTER_ID is not None:
+            frame.after_cancel(ANIMATION_AFTER_ID)
 
-        # poll frames_ready to wait for frames to load
-        def start_animation():
-            if len(frames) < 2:
-                # wait for at least 2 frames to start
-                frame.after(50, start_animation)
-                return
+        # frames are decoded as they're needed, so we can start right away
+        # the frame shown is picked off the clock, so a late callback skips
+        # ahead instead of slowing the whole animation down
+        start_time = time.monotonic()
+        last_index = 0
 
-            def update(index: int):
-                if index >= len(frames):
-                    # stop at the last frame
-                    return
-                dude_img_label.configure(image=frames[index])
-                frame.after(20, update, index + 1)
+        def tick():
+            global ANIMATION_AFTER_ID
+            nonlocal last_index
 
-            update(0)
+            index = int((time.monotonic() - start_time) * ANIMATION_FPS)
+            # stop at the last frame
+            index = min(index, FRAMES.count - 1)
 
+            if index != last_index:
+                dude_img_label.configure(image=FRAMES.get(index))
+                last_index = index
 
-        start_animation()
+            if index < FRAMES.count - 1:
+                ANIMATION_AFTER_ID = frame.after(ANIMATION_TICK_MS, tick)
+            else:
+                ANIMATION_AFTER_ID = None
 
-        instruction_label = ttk.Label(frame, text="Tap the screen!",
-                                    style="Instructions.TLabel")
-        instruction_label.place(relx=0.5, rely=0.71+.06, anchor="center")
+        ANIMATION_AFTER_ID = frame.after(ANIMATION_TICK_MS, tick)
 
-        # help label has to be rendered after img to be seen (layering)
-        help_label = ttk.Label(frame, text="Need help?", style="NeedHelp.TLabel")
-        help_label.place(relx=0.5, rely=0.57+.06, anchor="center")
+        MAIN_WIDGETS["instructions"].place(relx=0.5, rely=0.71+.06, anchor="center")
+        MAIN_WIDGETS["help"].place(relx=0.5, rely=0.57+.06, anchor="center")
 
     load_contents()
 
@@ -200,12 +408,11 @@ def handle_interaction(root: tk.Tk, frame: tk.Frame, style: ttk.Style,
     :return: None
     :rtype: None
     """
-    device_id = slack.BUTTON_CONFIG["device_id"] # get device id
-    device_config = slack.get_device_config(SHEETS_SERVICE, SHEETS_SPREADSHEET_ID, device_id) # get config
-    device_rate_limit = int(device_config["rate_limit_seconds"]) # get rate limit
-    current_timestamp = time.time() # get current timestamp to compare to last message timestamp
+    # monotonic, so a clock change (e.g. NTP syncing after boot) can't skip or extend the rate limit
+    current_timestamp = time.monotonic()
+    elapsed = current_timestamp - slack.LAST_MESSAGE_TIMESTAMP if slack.LAST_MESSAGE_TIMESTAMP is not None else None
 
-    if slack.LAST_MESSAGE_TIMESTAMP and current_timestamp - slack.LAST_MESSAGE_TIMESTAMP < device_rate_limit:
+    def show_rate_limited():
         tsprint("Rate limit applied. Message not sent.")
         ratelimit_label = ttk.Label(frame, text="Rate limit applied. Please wait before tapping again.",
                                     style="Escape.TLabel")
@@ -218,21 +425,51 @@ def handle_interaction(root: tk.Tk, frame: tk.Frame, style: ttk.Style,
                 tsprint(f"ERROR: Could not play rate limit sound:\n{e}")
         root.after(3 * 1000, fade_label, root,
                     ratelimit_label, hex_to_rgb(MAIZE), hex_to_rgb(BLUE), 0, 1500)
+
+    # taps within the last known rate limit are turned away without going to Sheets,
+    # otherwise the worker fetches the config in case the rate limit has changed
+    if DEVICE_CONFIG is not None and elapsed is not None and elapsed < int(DEVICE_CONFIG["rate_limit_seconds"]):
+        show_rate_limited()
         return
-    slack.LAST_MESSAGE_TIMESTAMP = current_timestamp
-    
+
     root.unbind("<ButtonPress-1>") # unbind clicks upon interaction
 
     def worker():
+        global current_message_id, DEVICE_CONFIG
+
         tsprint(f"GUI handling interaction (do_post={do_post})")
 
+        # fetched here rather than on the Tk thread, since Sheets retries
+        # can hold things up for a while when the network is down
+        device_id = slack.BUTTON_CONFIG["device_id"] # get device id
+        try:
+            device_config = slack.get_device_config(SHEETS_SERVICE, SHEETS_SPREADSHEET_ID, device_id) # get config
+        except Exception as e:
+            # ignore the tap, the next one will try again
+            tsprint(f"ERROR: Could not get config for device {device_id}. Interaction ignored:\n{e!r}")
+            UI_QUEUE.put(lambda: bind_presses(root, frame, style, do_post))
+            return
+        DEVICE_CONFIG = device_config
+
+        if elapsed is not None and elapsed < int(device_config["rate_limit_seconds"]):
+            def rate_limited():
+                show_rate_limited()
+                bind_presses(root, frame, style, do_post)
+            UI_QUEUE.put(rate_limited)
+            return
+        slack.LAST_MESSAGE_TIMESTAMP = current_timestamp
+
+        # the last interaction's message isn't ours to time out anymore
+        with pending_message_ids_lock:
+            current_message_id = None
+
         # update the GUI FIRST so as to prevent any delay
         def gui_update():
             # clear display and switch frames
             for widget in frame.winfo_children():
                 widget.place_forget()
 
-            display_post_interaction(root, frame, style, do_post)
+            display_post_interaction(root, frame, style, do_post, device_config)
 
             if is_simpleaudio_installed:
                 try:
@@ -240,23 +477,39 @@ def handle_interaction(root: tk.Tk, frame: tk.Frame, style: ttk.Style,
                     tsprint("Played interact sound.")
                 except Exception as e:
                     tsprint(f"ERROR: Could not play interact sound:\n{e}")
-        root.after(0, gui_update)
-
-        message_id, channel_id = slack.handle_interaction(
-            slack.lambda_client,
-            SHEETS_SERVICE,
-            SHEETS_SPREADSHEET_ID,
-            do_post=do_post
-        )
+        UI_QUEUE.put(gui_update)
+
+        try:
+            result = slack.handle_interaction(
+                slack.lambda_client,
+                SHEETS_SERVICE,
+                SHEETS_SPREADSHEET_ID,
+                do_post=do_post
+            )
+        except Exception as e: # e.g. DeviceNotConfigured, or AWS being unreachable
+            # nothing was posted, so don't leave the user waiting on a reply
+            tsprint(f"ERROR: Could not post interaction for device {device_id}:\n{e!r}")
+            slack.LAST_MESSAGE_TIMESTAMP = None
+            UI_QUEUE.put(lambda: revert_to_main(root, frame, style, do_post))
+            return
+
+        # not posting, so there's no message to keep track of
+        if result is None:
+            return
+
+        message_id, channel_id = result
+        # both are read together by the GUI thread, so publish them together
         with pending_message_ids_lock:
-            pending_message_ids.append(message_id)
-        message_to_channel[message_id] = channel_id
+            message_to_channel[message_id] = channel_id
+            pending_message_ids.add(message_id)
+            current_message_id = message_id
 
         tsprint(f"GUI received interaction result: message_id={message_id} channel_id={channel_id}")
 
-    threading.Thread(target=worker, daemon=True).start()
+    submit_io(worker)
 
-def display_post_interaction(root: tk.Tk, frame: tk.Frame, style: ttk.Style, do_post: bool) -> None:
+def display_post_interaction(root: tk.Tk, frame: tk.Frame, style: ttk.Style, do_post: bool,
+                             device_config: dict) -> None:
     """
     Displays the post interaction instructions
 
@@ -272,10 +525,15 @@ def display_post_interaction(root: tk.Tk, frame: tk.Frame, style: ttk.Style, do_
     :param do_post: whether to post to Slack
     :type do_post: bool
 
+    :param device_config: the device config the interaction was handled with
+    :type device_config: dict
+
     :return: None
     :rtype: None
     """
 
+    global COUNTDOWN_AFTER_ID, POLL_STOP_EVENT, REPLY_HANDLER
+
     base_timeout = 180
 
     # countdown
@@ -298,28 +556,26 @@ def display_post_interaction(root: tk.Tk, frame: tk.Frame, style: ttk.Style, do_
     text_widget.tag_configure("right", justify="right")
     text_widget.tag_add("right", "1.0", "end")
 
-    def update_text_widget():
-        if not text_widget.winfo_exists():
-            return
-        
-        text_widget.config(state=tk.NORMAL) # enable editing
-
-        text_widget.delete("1.0", tk.END)
-
-        text_widget.insert(tk.END, f"{' ' if timeout < 100 else ''}", "countdown")
-        text_widget.insert(tk.END, "Request times out in ", "timeout")
-        text_widget.insert(tk.END, f"{timeout}", "countdown")
-        text_widget.insert(tk.END, " seconds", "timeout")
+    # the static text only goes in once, after that each tick just swaps out
+    # the fixed-width (3 character) number between the two static spans
+    countdown_prefix = "Request times out in "
+    countdown_start = f"1.{len(countdown_prefix)}"
+    countdown_end = f"1.{len(countdown_prefix) + 3}"
 
-        text_widget.config(state=tk.DISABLED) # disable editing
+    text_widget.insert(tk.END, countdown_prefix, "timeout")
+    text_widget.insert(tk.END, f"{timeout:3d}", "countdown")
+    text_widget.insert(tk.END, " seconds", "timeout")
+    text_widget.configure(state="disabled")
 
-    # Initial update
-    update_text_widget()
+    def update_text_widget():
+        # only editable for as long as it takes to swap the number
+        text_widget.configure(state="normal")
+        text_widget.replace(countdown_start, countdown_end, f"{timeout:3d}", "countdown")
+        text_widget.configure(state="disabled")
 
-    polling_thread = threading.Thread(target=aws.poll_sqs,
-                                      args=[aws.SQS_CLIENT, slack.BUTTON_CONFIG["device_id"]],
-                                      daemon=True)
-    polling_thread.start()
+    POLL_STOP_EVENT = aws.start_polling(aws.SQS_CLIENT,
+                                        slack.BUTTON_CONFIG["device_id"],
+                                        lambda: UI_QUEUE.put(handle_replies))
 
     # this helps determine whether we've received a reply later
     reply_received = False
@@ -331,31 +587,34 @@ def display_post_interaction(root: tk.Tk, frame: tk.Frame, style: ttk.Style, do_
 
         return now
 
-    # do a timeout countdown
-    def countdown():
+    # handle SQS replies as soon as the poller hands them over, on the Tk thread
+    def drain_replies():
         nonlocal timeout, reply_received
         nonlocal root, frame, style, do_post
 
-        # decrement seconds left and set the label's text
-        timeout -= 1
-        update_text_widget()
+        while True:
+            # a late reply can arrive after we've already left this screen
+            if not waiting_label.winfo_exists():
+                return
 
-        # if we have a message from SQS, make sure it's ours and then use it
-        if aws.LATEST_MESSAGE:
-            ts = aws.LATEST_MESSAGE["ts"]
-            reply_author = aws.LATEST_MESSAGE["reply_author"]
-            reply_text = aws.LATEST_MESSAGE["reply_text"]
+            # if we have a message from SQS, make sure it's ours and then use it
+            try:
+                latest_message = aws.MESSAGE_QUEUE.get_nowait()
+            except queue.Empty:
+                return
+
+            ts = latest_message["ts"]
+            reply_author = latest_message["reply_author"]
+            reply_text = latest_message["reply_text"]
 
             with pending_message_ids_lock:
                 if ts in pending_message_ids:
                     # if no resolving reaction/emoji, display message
-                    if not "white_check_mark" in reply_text and not "+1" in reply_text:
+                    if not is_resolution(reply_text):
                         received_label.configure(text="")
                         waiting_label.configure(text=f"From {reply_author}\n" + reply_text)
                         waiting_label.place_configure(rely=0.5)
 
-                        aws.LATEST_MESSAGE = None
-
                         # bump the timer up if necessary
                         if timeout <= base_timeout // 3 + 1:
                             timeout = base_timeout // 3 + 1
@@ -364,15 +623,11 @@ def display_post_interaction(root: tk.Tk, frame: tk.Frame, style: ttk.Style, do_
                         # still allow for multi-replies
                         reply_received = True
 
-                        # if we've received a reply mark it replied
-                        message_id = pending_message_ids[0]
+                        # if we've received a reply mark the message it's on replied
+                        message_id = ts
                         channel_id = message_to_channel[message_id]
                         
-                        threading.Thread(
-                            target=aws.mark_message_replied,
-                            args=(slack.lambda_client, message_id, channel_id, True),
-                            daemon=True
-                        ).start()
+                        submit_io(aws.mark_message_replied, slack.lambda_client, message_id, channel_id, True)
 
 
                         if is_simpleaudio_installed:
@@ -383,27 +638,14 @@ def display_post_interaction(root: tk.Tk, frame: tk.Frame, style: ttk.Style, do_
                                 tsprint(f"ERROR: Could not play receive sound:\n{e}")
                     # else revert to main and cancel this countdown
                     else:
-                        sheets_button_config = slack.get_device_config(SHEETS_SERVICE,
-                                                                SHEETS_SPREADSHEET_ID,
-                                                                slack.BUTTON_CONFIG["device_id"])
-                        
                         cells = [
                             get_datetime(),
-                            sheets_button_config["location"],
+                            device_config["location"],
                             "Resolved"
                         ]
 
-                        if sheets_button_config["function"] != "Development":
-                            threading.Thread(
-                                target=sheets.add_row, 
-                                args = (
-                                    SHEETS_SERVICE, 
-                                    SHEETS_SPREADSHEET_ID,
-                                    cells,
-                                    SHEETS_TABS["logging"]
-                                ),
-                                daemon=True
-                            ).start()
+                        if device_config["function"] != "Development":
+                            SHEETS_LOGGER.add(cells)
 
                         revert_to_main(root, frame, style, do_post)
                         
@@ -414,56 +656,48 @@ def display_post_interaction(root: tk.Tk, frame: tk.Frame, style: ttk.Style, do_
                             except Exception as e:
                                 tsprint(f"ERROR: Could not play resolved sound:\n{e}")
 
-                        aws.LATEST_MESSAGE = None
+    # do a timeout countdown
+    def countdown():
+        global COUNTDOWN_AFTER_ID
+        nonlocal timeout, reply_received
+        nonlocal root, frame, style, do_post
+
+        # decrement seconds left and set the label's text
+        timeout -= 1
+        update_text_widget()
 
         if timeout <= 0:
             revert_to_main(root, frame, style, do_post)
 
-            sheets_button_config = slack.get_device_config(SHEETS_SERVICE,
-                                                    SHEETS_SPREADSHEET_ID,
-                                                    slack.BUTTON_CONFIG["device_id"])
-
             cells = [
                 get_datetime(),
-                sheets_button_config["location"],
+                device_config["location"],
                 "Replied" if reply_received else "Timed Out"
             ]
 
             # if we're using a non-development button, log
-            if sheets_button_config["function"] != "Development":
-                threading.Thread(
-                    target=sheets.add_row, 
-                    args = (
-                        SHEETS_SERVICE, 
-                        SHEETS_SPREADSHEET_ID,
-                        cells,
-                        SHEETS_TABS["logging"]
-                    ),
-                    daemon=True
-                ).start()
+            if device_config["function"] != "Development":
+                SHEETS_LOGGER.add(cells)
 
             # if we have a pending message or haven't received a reply,
             # we need to time out
             with pending_message_ids_lock:
-                if len(pending_message_ids) > 0 and not reply_received:
-                    message_id = pending_message_ids[0]
+                if current_message_id is not None and not reply_received:
+                    message_id = current_message_id
                     channel_id = message_to_channel[message_id]
 
-                    threading.Thread(
-                        target=aws.mark_message_timed_out,
-                        args=(slack.lambda_client, message_id, channel_id, True),
-                        daemon=True
-                    ).start()
+                    submit_io(aws.mark_message_timed_out, slack.lambda_client, message_id, channel_id, True)
 
 
         # schedule countdown until seconds_left is 1
         if timeout > 0:
-            root.after(1000, countdown)
+            COUNTDOWN_AFTER_ID = root.after(1000, countdown)
         else:
-            aws.STOP_THREAD = True
+            COUNTDOWN_AFTER_ID = None
             return
 
-    root.after(1000, countdown)
+    COUNTDOWN_AFTER_ID = root.after(1000, countdown)
+    REPLY_HANDLER = drain_replies
 
     received_label = tk.Label(frame,
                             text="Help is on the way!",
@@ -483,11 +717,9 @@ def display_post_interaction(root: tk.Tk, frame: tk.Frame, style: ttk.Style, do_
                             anchor="center",
                             justify="center"
                             )
-    waiting_label.configure(wraplength=root.winfo_screenwidth())
+    waiting_label.configure(wraplength=SCREEN_WIDTH)
     waiting_label.place(relx=0.5, rely=0.60, anchor="center")
 
-    root.update_idletasks() # gets stuff to load all at once
-
 def revert_to_main(root: tk.Tk, frame: tk.Frame, style: ttk.Style, do_post: bool) -> None:
     """
     Reverts from another frame to the main display
@@ -508,14 +740,31 @@ def revert_to_main(root: tk.Tk, frame: tk.Frame, style: ttk.Style, do_post: bool
     :rtype: None
     """
 
+    global COUNTDOWN_AFTER_ID, POLL_STOP_EVENT, REPLY_HANDLER
+
+    # stop the countdown if we're leaving before it ran out
+    if COUNTDOWN_AFTER_ID is not None:
+        root.after_cancel(COUNTDOWN_AFTER_ID)
+        COUNTDOWN_AFTER_ID = None
+
+    # and SQS polling, replies that still turn up are left for the next screen to check
+    if POLL_STOP_EVENT is not None:
+        aws.stop_polling(POLL_STOP_EVENT)
+        POLL_STOP_EVENT = None
+    REPLY_HANDLER = None
+
+    # the main screen's own labels get reused, everything else goes
+    main_widgets = set(MAIN_WIDGETS.values())
     for widget in frame.winfo_children():
-        widget.destroy()
+        if widget not in main_widgets:
+            widget.destroy()
 
     # restore left click bindings
     bind_presses(root, frame, style, do_post)
 
     display_main(frame, style)
 
+@functools.lru_cache(maxsize=None)
 def hex_to_rgb(hex_str: str) -> tuple:
     """
     Converts a hex string (#000000) to an RGB tuple ((0, 0, 0))
@@ -527,8 +776,7 @@ def hex_to_rgb(hex_str: str) -> tuple:
     :rtype: tuple[int, int, int]
     """
 
-    hex_str = hex_str.lstrip("#")
-    return tuple(int(hex_str[i:i+2], 16) for i in (0, 2, 4))
+    return tuple(bytes.fromhex(hex_str.lstrip("#")))
 
 # https://stackoverflow.com/questions/57337718/smooth-transition-in-tkinter
 def interpolate(start_color: tuple, end_color: tuple, time_: int) -> tuple:
@@ -549,9 +797,34 @@ def interpolate(start_color: tuple, end_color: tuple, time_: int) -> tuple:
     """
     return tuple(int(a + (b - a) * time_) for a, b in zip(start_color, end_color))
 
+@functools.lru_cache(maxsize=None)
+def build_fade_table(start_color: tuple, end_color: tuple, steps: int) -> tuple:
+    """
+    Precomputes every hex color a fade passes through, so each fade step
+    is just a lookup
+
+    :param start_color: the color to start with
+    :type start_color: tuple[int, int, int]
+
+    :param end_color: the color to end with
+    :type end_color: tuple[int, int, int]
+
+    :param steps: the number of steps in the fade
+    :type steps: int
+
+    :return: steps + 1 hex strings, from start_color to end_color
+    :rtype: tuple[str, ...]
+    """
+    table = []
+    for step in range(steps + 1):
+        color = interpolate(start_color, end_color, step / steps)
+        table.append(f"#{color[0]:02x}{color[1]:02x}{color[2]:02x}")
+
+    return tuple(table)
+
 # https://stackoverflow.com/questions/57337718/smooth-transition-in-tkinter
 def fade_label(frame: tk.Tk, label: ttk.Label, start_color: tuple, end_color: tuple,
-               current_step: int, fade_duration_ms: int) -> None:
+               current_step: int, fade_duration_ms: int, table: tuple = None) -> None:
     """
     A recursive function that fades a label from one color to another
 
@@ -573,6 +846,9 @@ def fade_label(frame: tk.Tk, label: ttk.Label, start_color: tuple, end_color: tu
     :param fade_duration_ms: the length of time to fade for, in MS
     :type fade_duration_ms: int
 
+    :param table: for recursion, the precomputed colors from build_fade_table
+    :type table: tuple[str, ...]
+
     :return: None
     :rtype: None
     """
@@ -580,22 +856,68 @@ def fade_label(frame: tk.Tk, label: ttk.Label, start_color: tuple, end_color: tu
     # set a framerate for the fade
     fps = 30
 
-    time_ = (1.0 / fps) * current_step
-    current_step += 1
+    if table is None:
+        table = build_fade_table(start_color, end_color, fps)
 
-    new_color = interpolate(start_color, end_color, time_)
-    label.configure(foreground=f"#{new_color[0]:02x}{new_color[1]:02x}{new_color[2]:02x}")
+    label.configure(foreground=table[current_step])
+    current_step += 1
 
     if current_step <= fps:
         frame.after(fade_duration_ms // fps, fade_label, frame,
                    label, start_color, end_color, current_step,
-                   fade_duration_ms)
+                   fade_duration_ms, table)
+
+def handle_replies() -> None:
+    """
+    Hands new SQS replies to whichever screen currently takes them.
+    Must only ever run on the main thread
+    """
+    # looked up when the replies arrive, not when the poller started,
+    # since a poller can outlive the screen that started it
+    if REPLY_HANDLER is not None:
+        REPLY_HANDLER()
+
+def drain_ui_queue(root: tk.Tk) -> None:
+    """
+    Runs every callable background threads have queued for the GUI,
+    then reschedules itself. Must only ever run on the main thread
+
+    :param root: the root of the window
+    :type root: tk.Tk
+    """
+    try:
+        while True:
+            try:
+                callback = UI_QUEUE.get_nowait()
+            except queue.Empty:
+                break
+
+            # one failing callback mustn't take the rest (or the drain loop) down with it
+            try:
+                callback()
+            except Exception:
+                tsprint(f"ERROR: Queued GUI callback failed:\n{traceback.format_exc()}")
+    finally:
+        root.after(UI_DRAIN_MS, drain_ui_queue, root)
+
+def exit_gui(root: tk.Tk) -> None:
+    """
+    Closes the window, dropping any network calls that haven't started yet
+
+    IO_POOL's workers are joined when the interpreter exits, so queued calls
+    would otherwise keep the app open after the window is gone
+
+    :param root: the root window
+    :type root: tk.Tk
+    """
+    IO_POOL.shutdown(wait=False, cancel_futures=True)
+    root.destroy()
 
 def display_gui() -> None:
     """
     Displays the TKinter GUI. Essentially the main function
     """
-    global FONTS
+    global FONTS, SCREEN_WIDTH
 
     escape_display_period_ms = 5000
     do_post = True
@@ -609,6 +931,7 @@ def display_gui() -> None:
     root.attributes("-fullscreen", True)
     root.configure(bg=BLUE)
     root.title("Slack Lambda Button")
+    SCREEN_WIDTH = root.winfo_screenwidth()
 
     display_frame = tk.Frame(root, bg=BLUE)
     display_frame.place(relx=0, rely=0, relwidth=1, relheight=1)
@@ -617,16 +940,22 @@ def display_gui() -> None:
     style = ttk.Style()
 
     # bind keys/buttons
-    root.bind("<Escape>", lambda event: exit(0))
+    root.bind("<Escape>", lambda event: exit_gui(root)) # mainloop returns and we exit normally
     bind_presses(root, display_frame, style, do_post)
+    drain_ui_queue(root)
 
-    preload_frames_lazy()
+    if FRAMES is None:
+        preload_frames_lazy()
+    FRAMES.master = root
     FONTS = preload_fonts()
 
-    display_main(display_frame, style)
-
+    # styles only need configuring once, not every time we go back to the main screen
+    style.configure("NeedHelp.TLabel", foreground=MAIZE, background=BLUE, font=FONTS["oswald_96"])
+    style.configure("Instructions.TLabel", foreground=MAIZE, background=BLUE, font=FONTS["oswald_80"])
     style.configure("Escape.TLabel", foreground=MAIZE, background=BLUE, font=FONTS["oswald_42"])
 
+    display_main(display_frame, style)
+
     # set up the actual items in the display
     escape_label = ttk.Label(display_frame, text="Press escape to exit", style="Escape.TLabel")
     escape_label.place(relx=0.99, rely=0.99, anchor="se")
@@ -651,10 +980,10 @@ if __name__ == "__main__":
     tsprint("Starting slack-Lambda-button gui.")
     process.set_process_name_linux()
     
-    _, sheets_service, _, spreadsheet_id, tabs = sheets.setup_sheets()
-    SHEETS_SERVICE = sheets_service
-    SHEETS_SPREADSHEET_ID = spreadsheet_id
-    SHEETS_TABS = tabs
+    # sheets setup is network bound and the sounds/animation are disk bound,
+    # so let them overlap instead of running one after another
+    sheets_future = IO_POOL.submit(sheets.setup_sheets)
+    preload_frames_lazy()
 
     # simpleaudio setup, in main so that it happens after create_logfile and cleans up code a bit
     try:
@@ -674,4 +1003,17 @@ if __name__ == "__main__":
     except ImportError:
         tsprint("WARNING: simpleaudio not installed, audio will not play.")
 
+    _, sheets_service, _, spreadsheet_id, tabs = sheets_future.result()
+    SHEETS_SERVICE = sheets_service
+    SHEETS_SPREADSHEET_ID = spreadsheet_id
+    SHEETS_TABS = tabs
+
+    # fetch the device config now, so the first tap is served from the cache,
+    # this is only an optimization so failing here (e.g. offline) just gets logged
+    submit_io(slack.get_device_config, SHEETS_SERVICE, SHEETS_SPREADSHEET_ID, slack.BUTTON_CONFIG["device_id"])
+
+    # write out any rows still buffered when we exit
+    SHEETS_LOGGER = sheets.RowBatcher(SHEETS_SERVICE, SHEETS_SPREADSHEET_ID, SHEETS_TABS["logging"])
+    atexit.register(SHEETS_LOGGER.flush)
+
     display_gui()
\ No newline at end of file
@@ -30,7 +30,7 @@ try:
         AWS_CONFIG = json.load(file)
 
         # if we don't have all required keys, populate the defaults
-        if not all(AWS_CONFIG.get(key) for key in list(CONFIG_DEFAULTS.keys())):
+        if not all(AWS_CONFIG.get(key) for key in CONFIG_DEFAULTS):
             with open("config/aws.json", "w", encoding="utf8") as write_file:
                 json.dump(CONFIG_DEFAULTS, write_file)
 except (FileNotFoundError, json.JSONDecodeError):
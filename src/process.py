@@ -1,29 +1,48 @@
-from ctypes import cdll, byref, create_string_buffer
+import functools
+import sys
 from nikki_utils import tsprint
-import platform
 
-def set_process_name_linux(process_name: str = b"SLB-GUI\x00"):
+IS_LINUX = sys.platform.startswith("linux")
+PR_SET_NAME = 15 # from <linux/prctl.h>
+TASK_COMM_LEN = 16 # the kernel's limit on process names, including the null terminator
+
+@functools.lru_cache(maxsize=1)
+def get_libc():
+    """
+    Loads libc once and hands back the same handle afterwards.
+    ctypes is only imported here, so other platforms never pay for it
+
+    :return: the loaded C library
+    :rtype: ctypes.CDLL
+    """
+    import ctypes
+
+    libc = ctypes.CDLL("libc.so.6", use_errno=True)  # Loading a 3rd party library C
+    libc.prctl.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong]
+    libc.prctl.restype = ctypes.c_int
+
+    return libc
+
+def set_process_name_linux(process_name: bytes = b"SLB-GUI"):
     """
     Adapated from https://stackoverflow.com/questions/51521320/tkinter-python-how-to-give-process-name
-    :param process_name: the null (\x00) terminated byte-string name to set the process to
+    :param process_name: the byte-string name to set the process to, at most 15 bytes are used
     :type process_name: bytes
     """
 
     tsprint("set_process_name_linux called.")
 
     # only on Linux
-    if platform.system() == "Linux":
+    if IS_LINUX:
         tsprint("Platform is Linux. Attempting to set process name.")
-        process_name = process_name + b"\x00"
-
-        libc = cdll.LoadLibrary('libc.so.6')  # Loading a 3rd party library C
-        buff = create_string_buffer(len(process_name)+1)  # Note: One larger than the name (man prctl says that)
-        buff.value = process_name
+        # c_char_p adds the one null terminator itself, and the kernel would
+        # silently cut anything past TASK_COMM_LEN anyway
+        process_name = process_name.rstrip(b"\x00")[:TASK_COMM_LEN - 1]
 
         try:
-            libc.prctl(15, byref(buff), 0, 0, 0)
+            get_libc().prctl(PR_SET_NAME, process_name, 0, 0, 0)
             tsprint(f"Process name set to {process_name}.")
         except Exception as e:
             tsprint(f"ERROR: Failed to set process name: {e}")
     else:
-        tsprint("Platform is not Linux. Skipping setting process name.")
\ No newline at end of file
+        tsprint("Platform is not Linux. Skipping setting process name.")
@@ -10,24 +10,127 @@ Nikki Hess (nkhess@umich.edu)
 # built-in
 import os
 import json
+import re
 import time
+import threading
 import traceback
 
 # PyPi
-from google.auth.transport.requests import Request
+# the OAuth flow, token refresh and service building imports are heavy and
+# often not needed (e.g. valid cached token), so they're imported where used
 from google.auth.exceptions import RefreshError
 from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.model import JsonModel
+import orjson
 
 # my modules
 from nikki_utils import tsprint
 from . import config
 
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
-CACHE = {}
+CACHE = {} # expiries are time.monotonic() values, so clock changes can't skew them
 CACHE_COOLDOWN = 60 * 60 # 60 minutes in seconds
+REGIONS_PER_TAB = 32 # cached regions kept per tab, the least recently used go first
+# googleapiclient retries 429s and 5xxs itself, with randomized exponential backoff
+# only for idempotent requests though, a retried append or create that had
+# actually gone through would be written twice
+EXECUTE_RETRIES = 5
+# only the spreadsheet metadata we actually use, not every sheet's formatting etc.
+SPREADSHEET_FIELDS = "spreadsheetId,properties.title,sheets.properties(sheetId,title,index)"
+TOKEN_PATH = "oauth/google_token.json"
+# the last credentials we loaded, and the token file's mtime when we did
+CREDS, CREDS_MTIME = None, None
+# httplib2 connections aren't thread-safe, so each thread (IO pool workers, row batchers)
+# keeps its own authorized connection, alive between its calls
+THREAD_HTTP = threading.local()
+SERVICE, SERVICE_CREDS = None, None # the Sheets service reused by every setup_sheets, and the credentials it was built with
+
+class OrjsonModel(JsonModel):
+	"""
+	googleapiclient's JSON model, but parsing responses with orjson
+	"""
+
+	def deserialize(self, content):
+		"""
+		Parses a response body
+
+		:param content: the raw response body
+		:type content: bytes | str
+
+		:return: the parsed body, or the content as-is if it isn't JSON
+		:rtype: Any
+		"""
+		try:
+			body = orjson.loads(content)
+		except orjson.JSONDecodeError:
+			# match JsonModel, which hands back non-JSON bodies as text
+			return content.decode("utf-8") if isinstance(content, bytes) else content
+
+		if self._data_wrapper and "data" in body:
+			body = body["data"]
+
+		return body
+
+def get_spreadsheet_cache(spreadsheet_id: str) -> dict:
+	"""
+	Gets the cache for a single spreadsheet, creating it on first use
+
+	:param spreadsheet_id: the spreadsheet to get the cache for
+	:type spreadsheet_id: str
+
+	:return: the spreadsheet's cache, with "contents", "emptiness", "first_empty_row" and "regions" sections
+	:rtype: dict
+	"""
+	spreadsheets = CACHE.setdefault("spreadsheets", {})
+
+	spreadsheet_cache = spreadsheets.get(spreadsheet_id)
+	if spreadsheet_cache is None:
+		spreadsheet_cache = spreadsheets[spreadsheet_id] = {
+			"contents": {},
+			"emptiness": {},
+			"first_empty_row": {},
+			"regions": {}
+		}
+
+	return spreadsheet_cache
+
+def get_cached(section: dict, key: str):
+	"""
+	Gets a value from a cache section, if it's there and hasn't expired
+
+	:param section: the cache section to look in
+	:type section: dict
+
+	:param key: the key to look up
+	:type key: str
+
+	:return: the cached value, or None if there isn't a fresh one
+	:rtype: Any
+	"""
+	entry = section.get(key)
+	if entry is not None and entry["expiry"] > time.monotonic():
+		return entry["value"]
+
+	return None
+
+def set_cached(section: dict, key: str, value) -> None:
+	"""
+	Stores a value in a cache section for CACHE_COOLDOWN seconds
+
+	:param section: the cache section to store in
+	:type section: dict
+
+	:param key: the key to store under
+	:type key: str
+
+	:param value: the value to store
+	:type value: Any
+	"""
+	section[key] = {
+		"value": value,
+		"expiry": time.monotonic() + CACHE_COOLDOWN
+	}
 
 def do_oauth_flow() -> Credentials:
 	"""
@@ -37,25 +140,42 @@ def do_oauth_flow() -> Credentials:
 	:rtype: Credentials
 	"""
 
+	global CREDS, CREDS_MTIME
+
 	tsprint("Starting Google OAuth flow.")
 	creds = None
 
-	if os.path.exists("oauth/google_token.json"):
+	try:
+		token_mtime = os.stat(TOKEN_PATH).st_mtime
+	except FileNotFoundError:
+		token_mtime = None
+
+	# skip re-reading the token unless it's changed on disk (or expired) since last time
+	if CREDS is not None and CREDS.valid and token_mtime == CREDS_MTIME:
+		tsprint("Reusing loaded Google Cloud credentials.")
+		return CREDS
+
+	if token_mtime is not None:
 		try:
-			creds = Credentials.from_authorized_user_file("oauth/google_token.json", SCOPES)
+			creds = Credentials.from_authorized_user_file(TOKEN_PATH, SCOPES)
 		except (ValueError, json.JSONDecodeError):
 			pass # just don't get creds
 	
 	# If there are no (valid) credentials available, let the user log in.
 	if not creds or not creds.valid:
 		if creds and creds.expired and creds.refresh_token:
+			from google.auth.transport.requests import Request
+
 			try:
 				creds.refresh(Request())
 				tsprint("Google Cloud token refreshed.")
 			except RefreshError: # google RefreshError, need new token
 				tsprint("New Google Cloud token needed, running OAuth flow.")
 
-				os.remove("oauth/google_token.json") # clear expired token
+				CREDS, CREDS_MTIME = None, None
+				os.remove(TOKEN_PATH) # clear expired token
+
+				from google_auth_oauthlib.flow import InstalledAppFlow
 				flow = InstalledAppFlow.from_client_secrets_file(
 					"oauth/google_credentials.json", SCOPES
 				)
@@ -63,15 +183,25 @@ def do_oauth_flow() -> Credentials:
 		else:
 			tsprint("New Google Cloud token needed, running OAuth flow.")
 
+			from google_auth_oauthlib.flow import InstalledAppFlow
 			flow = InstalledAppFlow.from_client_secrets_file(
 				"oauth/google_credentials.json", SCOPES
 			)
 			creds = flow.run_local_server(port=0)
 		
 		# Save the credentials for the next run
-		with open("oauth/google_token.json", "w", encoding="utf8") as token:
-			tsprint("Writing new token to file.")
+		# written to a private temp file and swapped in, so a crash mid-write
+		# can't leave a corrupt token behind
+		tsprint("Writing new token to file.")
+		temp_path = TOKEN_PATH + ".tmp"
+		fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+		with os.fdopen(fd, "w", encoding="utf8") as token:
 			token.write(creds.to_json())
+		os.replace(temp_path, TOKEN_PATH)
+
+		token_mtime = os.stat(TOKEN_PATH).st_mtime
+
+	CREDS, CREDS_MTIME = creds, token_mtime
 
 	tsprint("Google Cloud OAuth flow complete.")
 	return creds
@@ -104,7 +234,7 @@ def create_spreadsheet(sheets_service, name: str = "Untitled") -> dict:
 		sheets_service
 		.spreadsheets()
 		.create(body=spreadsheet, fields="spreadsheetId")
-		.execute()
+		.execute() # not idempotent, so no retries
 	)
 
 	tsprint(f"Spreadsheet with name {name} created successfully!")
@@ -127,24 +257,21 @@ def get_spreadsheet(sheets_service, spreadsheet_id: str) -> dict:
 
 	tsprint(f"Getting spreadsheet {spreadsheet_id}")
 
-	spreadsheet = None
+	contents_cache = get_spreadsheet_cache(spreadsheet_id)["contents"]
+	spreadsheet = get_cached(contents_cache, "spreadsheet")
 
-	cached_spreadsheet = CACHE.get("spreadsheets", {}).get(spreadsheet_id, None)
-	cached_contents = cached_spreadsheet.get("contents") if cached_spreadsheet else None
-	contents_expiry = cached_spreadsheet.get("contents_expiry") if cached_spreadsheet else None
-
-	if cached_contents is not None and contents_expiry > time.time():
+	if spreadsheet is not None:
 		tsprint(f"Spreadsheet {spreadsheet_id} found in cache. Retrieving.")
-		spreadsheet = CACHE["spreadsheets"][spreadsheet_id]["contents"]
 	else:
-		spreadsheet = sheets_service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+		spreadsheet = (
+			sheets_service.spreadsheets()
+			.get(spreadsheetId=spreadsheet_id, fields=SPREADSHEET_FIELDS)
+			.execute(num_retries=EXECUTE_RETRIES)
+		)
 		tsprint(f"Got existing spreadsheet with ID: {spreadsheet_id}")
 		tsprint("Caching spreadsheet.")
 
-		# we need to make sure the structure exists first by setting a default
-		cached_spreadsheet = CACHE.setdefault("spreadsheets", {}).setdefault(spreadsheet_id, {})
-		cached_spreadsheet["contents"] = spreadsheet
-		cached_spreadsheet["contents_expiry"] = time.time() + CACHE_COOLDOWN
+		set_cached(contents_cache, "spreadsheet", spreadsheet)
 
 	return spreadsheet
 
@@ -168,17 +295,10 @@ def is_spreadsheet_empty(sheets_service, spreadsheet_id: str, tab_name: str = No
 
 	tab_key = tab_name or "__default__"
 
-	cached_spreadsheet = CACHE.get("spreadsheets", {}).get(spreadsheet_id, None)
-	cached_emptiness = (
-		cached_spreadsheet
-		.get("emptiness", {})
-		.get(tab_key)
-		if cached_spreadsheet else None
-	)
-	cached_empty_value = cached_emptiness.get("value", None)
-	emptiness_expiry = cached_emptiness.get("expiry", None)
+	emptiness_cache = get_spreadsheet_cache(spreadsheet_id)["emptiness"]
+	cached_empty_value = get_cached(emptiness_cache, tab_key)
 
-	if cached_empty_value is not None and emptiness_expiry > time.time():
+	if cached_empty_value is not None:
 		tsprint(f"Cached value found for spreadsheet (tab {tab_name}) emptiness: {cached_empty_value}")
 		return cached_empty_value
 	else:
@@ -191,20 +311,16 @@ def is_spreadsheet_empty(sheets_service, spreadsheet_id: str, tab_name: str = No
 				sheets_service.spreadsheets()
 				.values().get(
 					spreadsheetId=spreadsheet_id,
-					range=sheets_range
-				).execute()
+					range=sheets_range,
+					fields="values"
+				).execute(num_retries=EXECUTE_RETRIES)
 			)
 
 			values = result.get("values", [])
 			empty = (len(values) == 0)
 
-			spreadsheet_cache = CACHE.setdefault("spreadsheets", {}).setdefault(spreadsheet_id, {})
-			first_empty_cache = spreadsheet_cache.setdefault("emptiness", {})
-			first_empty_cache[tab_key] = {
-				"value": empty,
-				"expiry": time.time() + CACHE_COOLDOWN
-			}
-			
+			set_cached(emptiness_cache, tab_key, empty)
+
 			tsprint(f"Spreadsheet {spreadsheet_id} {'is' if empty else 'is not'} empty.")
 
 			return empty
@@ -231,18 +347,10 @@ def find_first_empty_row(sheets_service, spreadsheet_id: str, tab_name: str = No
 
 	tab_key = tab_name or "__default__"
 
-	cached_spreadsheet = CACHE.get("spreadsheets", {}).get(spreadsheet_id, None)
-	cached_tab = (
-		cached_spreadsheet
-		.get("first_empty_row", {})
-		.get(tab_key)
-		if cached_spreadsheet else None
-	)
-
-	cached_index = cached_tab.get("index") if cached_tab else None
-	index_expiry = cached_tab.get("expiry") if cached_tab else None
+	first_empty_cache = get_spreadsheet_cache(spreadsheet_id)["first_empty_row"]
+	cached_index = get_cached(first_empty_cache, tab_key)
 
-	if cached_index is not None and index_expiry > time.time():
+	if cached_index is not None:
 		first_empty = cached_index
 
 		tsprint(f"Cached value found for spreadsheet {spreadsheet_id} first empty row: {first_empty}")
@@ -256,29 +364,69 @@ def find_first_empty_row(sheets_service, spreadsheet_id: str, tab_name: str = No
 			.values()
 			.get(
 				spreadsheetId=spreadsheet_id,
-				range=sheets_range
+				range=sheets_range,
+				majorDimension="COLUMNS", # one flat list for the column, not a list per row
+				valueRenderOption="UNFORMATTED_VALUE",
+				fields="values"
 			)
-			.execute()
+			.execute(num_retries=EXECUTE_RETRIES)
 		)
 
-		values = result.get("values", [])
-		first_empty = len(values) + 1
+		# trailing empty cells are trimmed, so the column's length is the last used row
+		columns = result.get("values", [])
+		first_empty = (len(columns[0]) if columns else 0) + 1
 
-		# write to cache
-		spreadsheet_cache = CACHE.setdefault("spreadsheets", {}).setdefault(spreadsheet_id, {})
-		first_empty_cache = spreadsheet_cache.setdefault("first_empty_row", {})
-		first_empty_cache[tab_key] = {
-			"index": first_empty,
-			"expiry": time.time() + CACHE_COOLDOWN
-		}
+		set_cached(first_empty_cache, tab_key, first_empty)
 
 		tsprint(f"First empty row for spreadsheet {spreadsheet_id} tab {tab_name} is {first_empty}")
 
 	return first_empty # Return the number of non-empty rows
 		
+def batch_get_regions(sheets_service, spreadsheet_id: str, ranges: list[str],
+					  major_dimension: str = "ROWS") -> dict[str, list]:
+	"""
+	Gets several regions of a spreadsheet in a single API call
+
+	:param sheets_service: the Google Sheets service we're using
+	:type sheets_service: object
+
+	:param spreadsheet_id: the id of the spreadsheet we're working with
+	:type spreadsheet_id: str
+
+	:param ranges: the A1-notation ranges to get, including the tab if relevant
+	:type ranges: list[str]
+
+	:param major_dimension: "ROWS" to get each region as a list of rows, "COLUMNS" for a list of columns
+	:type major_dimension: str
+
+	:return: the contents of each region, keyed by the range as requested
+	:rtype: dict[str, list]
+	"""
+	tsprint(f"Batch retrieving regions {ranges} from spreadsheet {spreadsheet_id}")
+
+	result = (
+		sheets_service.spreadsheets()
+		.values()
+		.batchGet(
+			spreadsheetId=spreadsheet_id,
+			ranges=ranges,
+			majorDimension=major_dimension,
+			fields="valueRanges(values)"
+		)
+		.execute(num_retries=EXECUTE_RETRIES)
+	)
+
+	# value ranges come back in the order they were asked for, but with the
+	# range normalized by Google, so key them by what we asked for instead
+	value_ranges = result.get("valueRanges", [])
+	return {
+		sheets_range: value_range.get("values", [])
+		for sheets_range, value_range in zip(ranges, value_ranges)
+	}
+
 def add_row(sheets_service, spreadsheet_id: str, cells: list[str], tab_name: str = None):
 	"""
-	Adds a row at the first empty position on the spreadsheet
+	Appends a row after the last row of the spreadsheet's table
 
 	:param sheets_service: the Google Sheets service to be used
 	:type sheets_service: object
@@ -295,62 +443,157 @@ def add_row(sheets_service, spreadsheet_id: str, cells: list[str], tab_name: str
 	:return: the result of the execution
 	:rtype: dict
 	"""
-	tab_key = tab_name or "__default__"
+	return add_rows(sheets_service, spreadsheet_id, [cells], tab_name)
+
+def add_rows(sheets_service, spreadsheet_id: str, rows: list[list[str]], tab_name: str = None):
+	"""
+	Appends several rows after the last row of the spreadsheet's table,
+	in a single API call
+
+	:param sheets_service: the Google Sheets service to be used
+	:type sheets_service: object
+
+	:param spreadsheet_id: the id of the spreadsheet we're operating on
+	:type spreadsheet_id: str
+
+	:param rows: a list of rows, each a list of cell contents to set
+	:type rows: list[list[str]]
 
-	next_row = find_first_empty_row(sheets_service, spreadsheet_id, tab_name)
+	:param tab_name: the tab name to operate on, if it exists
+	:type tab_name: str
 
-	final_letter = len(cells) - 1
-	final_letter += ord('A')
-	final_letter = chr(final_letter) # 1 = A, 2 = B, etc.
+	:return: the result of the execution
+	:rtype: dict
+	"""
+	tab_key = tab_name or "__default__"
 
 	# the api-formatted body, containing cell values
-	body = {"values": [cells]}
+	body = {"values": rows}
 
-	# the range to select via the API, including the tab (if relevant) and encompassing row/col
-	sheets_range = f"A{next_row}:{final_letter}{next_row}"
+	# append finds the end of the table server-side, so we don't need to look it up first
+	sheets_range = "A:A"
 	if tab_name:
 		sheets_range = f"'{tab_name}'!{sheets_range}"
 
 	result = (
 		sheets_service.spreadsheets()
 		.values()
-		.update(
+		.append(
 			spreadsheetId=spreadsheet_id,
 			range=sheets_range,
 			valueInputOption="USER_ENTERED", # follow the same rules as if a user entered this info on the webapp
+			insertDataOption="INSERT_ROWS",
 			body=body
 		)
-		.execute()
+		.execute() # not idempotent, so no retries
 	)
 
-	spreadsheet_cache = CACHE["spreadsheets"].setdefault(spreadsheet_id, {})
+	# e.g. 'Logs'!A5:C6, where the trailing number is the last row written
+	updates = result.get("updates", {})
+	updated_range = updates.get("updatedRange", "")
+	last_row_match = re.search(r"(\d+)$", updated_range)
 
-	# update first empty row
-	spreadsheet_cache = CACHE.setdefault("spreadsheets", {}).setdefault(spreadsheet_id, {})
-	first_empty_cache = spreadsheet_cache.setdefault("first_empty_row", {})
-	first_empty_cache[tab_key] = {
-		"index": next_row + 1,
-		"expiry": time.time() + CACHE_COOLDOWN
-	}
+	spreadsheet_cache = get_spreadsheet_cache(spreadsheet_id)
 
-    # update emptiness, definitely not empty anymore
-	first_empty_cache = spreadsheet_cache.setdefault("emptiness", {})
-	first_empty_cache[tab_key] = {
-		"value": False,
-		"expiry": time.time() + CACHE_COOLDOWN
-	}
+	# the row after the ones we wrote is now the first empty one, if we know
+	# where they went, otherwise the cached one is just out of date
+	if last_row_match:
+		set_cached(spreadsheet_cache["first_empty_row"], tab_key, int(last_row_match.group(1)) + 1)
+	else:
+		spreadsheet_cache["first_empty_row"].pop(tab_key, None)
 
-	# invalidate regions cache
-	regions_cache = spreadsheet_cache.get("regions", {})
-	if tab_key in regions_cache:
-		del regions_cache[tab_key]
+	# and the tab definitely isn't empty anymore
+	set_cached(spreadsheet_cache["emptiness"], tab_key, False)
 
+	# any cached regions of this tab may be out of date now
+	invalidate_region(spreadsheet_id, tab_name)
 
-	tsprint(f"{result.get('updatedCells')} cells added in row {next_row} of spreadsheet {spreadsheet_id} tab {tab_name}: {cells}")
+	tsprint(f"{updates.get('updatedCells')} cells added in {updated_range} of spreadsheet {spreadsheet_id} tab {tab_name}: {rows}")
 	return result
 
+class RowBatcher:
+	"""
+	Buffers rows bound for one tab and writes them with a single API call,
+	once max_rows have built up or flush_interval seconds after the first arrives
+	"""
+
+	def __init__(self, sheets_service, spreadsheet_id: str, tab_name: str = None,
+				 max_rows: int = 10, flush_interval: float = 0.2):
+		"""
+		:param sheets_service: the Google Sheets service to be used
+		:type sheets_service: object
+
+		:param spreadsheet_id: the id of the spreadsheet we're operating on
+		:type spreadsheet_id: str
+
+		:param tab_name: the tab name to operate on, if it exists
+		:type tab_name: str
+
+		:param max_rows: how many rows to buffer before writing immediately
+		:type max_rows: int
+
+		:param flush_interval: how long to wait for more rows, in seconds
+		:type flush_interval: float
+		"""
+		self.sheets_service = sheets_service
+		self.spreadsheet_id = spreadsheet_id
+		self.tab_name = tab_name
+		self.max_rows = max_rows
+		self.flush_interval = flush_interval
+
+		self.rows = []
+		self.condition = threading.Condition()
+		self.write_lock = threading.Lock() # keeps batches in the order their rows were added
+
+		threading.Thread(target=self.run, daemon=True).start()
+
+	def add(self, cells: list[str]) -> None:
+		"""
+		Queues a row to be written
+
+		:param cells: a list of cell contents to set
+		:type cells: list[str]
+		"""
+		with self.condition:
+			self.rows.append(cells)
+			self.condition.notify()
+
+	def run(self) -> None:
+		"""
+		Waits for rows and flushes them, runs on its own thread
+		"""
+		while True:
+			with self.condition:
+				self.condition.wait_for(lambda: self.rows)
+
+				# give a burst a moment to finish before writing it out
+				deadline = time.monotonic() + self.flush_interval
+				while len(self.rows) < self.max_rows:
+					remaining = deadline - time.monotonic()
+					if remaining <= 0:
+						break
+					self.condition.wait(remaining)
+
+			self.flush()
+
+	def flush(self) -> None:
+		"""
+		Writes out every buffered row now
+		"""
+		with self.write_lock:
+			with self.condition:
+				rows, self.rows = self.rows, []
+
+			if not rows:
+				return
+
+			try:
+				add_rows(self.sheets_service, self.spreadsheet_id, rows, self.tab_name)
+			except Exception as e:
+				tsprint(f"ERROR: Could not write {len(rows)} row(s) to tab {self.tab_name}:\n{e}")
+
 def get_region(sheets_service, spreadsheet_id: str, tab_name: str = None, 
-			   first_row: int = 1, last_row: int = 1,
+			   first_row: int = 1, last_row: int | None = 1,
 			   first_letter: str = "A", last_letter: str = "A") -> list[str]:
 	"""
 	Gets a row in a spreadsheet by index (row_idx)
@@ -367,8 +610,8 @@ def get_region(sheets_service, spreadsheet_id: str, tab_name: str = None,
 	:param first_row: the first row that we need to get
 	:type first_row: int
 
-	:param last_row: the last row that we need to get
-	:type last_row: int
+	:param last_row: the last row that we need to get, or None for every row to the end of the tab
+	:type last_row: int | None
 
 	:param first_letter: the first column that we need to get
 	:type first_letter: str
@@ -380,11 +623,12 @@ def get_region(sheets_service, spreadsheet_id: str, tab_name: str = None,
 	:rtype: list
 	"""
 
-	if first_row < 1 or last_row < 1 or first_letter < "A" or last_letter < "A":
+	if first_row < 1 or (last_row is not None and last_row < 1) or first_letter < "A" or last_letter < "A":
 		raise ValueError("Google Sheets starts at A1!")
 
 	# the range to select via the API, including the tab (if relevant) and encompassing row/col
-	sheets_range = f"{first_letter}{first_row}:{last_letter}{last_row}"
+	# an open-ended range (e.g. A1:J) only returns rows up to the last populated one
+	sheets_range = f"{first_letter}{first_row}:{last_letter}{last_row or ''}"
 	if tab_name:
 		sheets_range = f"'{tab_name}'!{sheets_range}"
 
@@ -392,25 +636,25 @@ def get_region(sheets_service, spreadsheet_id: str, tab_name: str = None,
 
 	tab_key = tab_name or "__default__"
 
-	spreadsheet_cache = CACHE.setdefault("spreadsheets", {}).setdefault(spreadsheet_id, {})
-	regions_cache = spreadsheet_cache.setdefault("regions", {})
-	tab_regions = regions_cache.setdefault(tab_key, {})
-
-	cached_region = tab_regions.get(sheets_range)
-	region_expiry = cached_region.get("expiry") if cached_region else None
+	tab_regions = get_spreadsheet_cache(spreadsheet_id)["regions"].setdefault(tab_key, {})
+	cached_region = get_cached(tab_regions, sheets_range)
 
-	if cached_region and region_expiry > time.time():
+	if cached_region is not None:
 		tsprint(f"Cached region {sheets_range} found in spreadsheet {spreadsheet_id} tab {tab_name}")
-		return cached_region["contents"]
+
+		# move it to the back of the line for eviction
+		tab_regions[sheets_range] = tab_regions.pop(sheets_range)
+		return cached_region
 	else:
 		result = (
 			sheets_service.spreadsheets()
 			.values()
 			.get(
 				spreadsheetId=spreadsheet_id,
-				range=sheets_range
+				range=sheets_range,
+				fields="values"
 			)
-			.execute()
+			.execute(num_retries=EXECUTE_RETRIES)
 		)
 
 		try:
@@ -420,14 +664,62 @@ def get_region(sheets_service, spreadsheet_id: str, tab_name: str = None,
 
 		tsprint(f"Contents for region {sheets_range} retrieved. Caching.")
 
+		set_cached(tab_regions, sheets_range, contents)
 
-		tab_regions[sheets_range] = {
-			"contents": contents,
-			"expiry": time.time() + CACHE_COOLDOWN
-		}
+		# dicts keep insertion order, so the first key is the least recently used
+		while len(tab_regions) > REGIONS_PER_TAB:
+			del tab_regions[next(iter(tab_regions))]
 
 		return contents
 
+def invalidate_region(spreadsheet_id: str, tab_name: str = None) -> None:
+	"""
+	Forgets every cached region of a tab, so the next get_region fetches it again
+
+	:param spreadsheet_id: the id of the spreadsheet we're working with
+	:type spreadsheet_id: str
+
+	:param tab_name: the name of the tab to forget, if applicable
+	:type tab_name: str
+	"""
+	get_spreadsheet_cache(spreadsheet_id)["regions"].pop(tab_name or "__default__", None)
+
+def get_thread_http(creds: Credentials):
+	"""
+	Gets the calling thread's authorized connection, making it on first use
+	or if we've had to log in again since
+
+	:param creds: the credentials to authorize requests with
+	:type creds: Credentials
+
+	:return: this thread's connection
+	:rtype: AuthorizedHttp
+	"""
+	http = getattr(THREAD_HTTP, "http", None)
+	if http is None or http.credentials is not creds:
+		from google_auth_httplib2 import AuthorizedHttp
+		from googleapiclient.http import build_http
+
+		http = THREAD_HTTP.http = AuthorizedHttp(creds, http=build_http())
+
+	return http
+
+def build_request(http, *args, **kwargs):
+	"""
+	Builds a request like googleapiclient does, but sent over the calling
+	thread's own connection rather than the one the service was built with,
+	so the service can be shared between threads
+
+	:param http: the service's connection, only used for its credentials
+	:type http: AuthorizedHttp
+
+	:return: the request, ready to execute
+	:rtype: HttpRequest
+	"""
+	from googleapiclient.http import HttpRequest
+
+	return HttpRequest(get_thread_http(http.credentials), *args, **kwargs)
+
 def setup_sheets():
 	"""
 	Sets up a Google Sheet using the configuration provided.
@@ -439,6 +731,7 @@ def setup_sheets():
 		spreadsheet_id: the spreadsheet's id, for convenience
 		tabs: the tabs listed in the config
 	"""
+	global SERVICE, SERVICE_CREDS
 
 	tsprint("Setting up Google Sheets.")
 
@@ -451,12 +744,23 @@ def setup_sheets():
 	config_name = "config/google_config.json"
 	config_data = config.get_and_verify_config_data(config_name)
 
-	sheets_service = None
+	# reuse the same service instead of a fresh one per setup,
+	# unless we've had to log in again since it was made
+	if SERVICE is None or SERVICE_CREDS is not creds:
+		from googleapiclient.discovery import build
 
-	try:
-		sheets_service = build("sheets", "v4", credentials=creds)
-	except HttpError as error:
-		tsprint(error)
+		SERVICE, SERVICE_CREDS = None, creds
+
+		try:
+			# static_discovery uses the discovery document bundled with the library
+			# instead of fetching it over the network, and with that there's nothing
+			# worth probing for a discovery cache
+			SERVICE = build("sheets", "v4", http=get_thread_http(creds), model=OrjsonModel(),
+							requestBuilder=build_request, static_discovery=True, cache_discovery=False)
+		except HttpError as error:
+			tsprint(error)
+
+	sheets_service = SERVICE
 
 	spreadsheet_id = config_data.get("id")
 	spreadsheet = get_spreadsheet(
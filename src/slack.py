@@ -9,7 +9,6 @@ Nikki Hess (nkhess@umich.edu)
 
 # built-in
 import time
-import threading
 import re
 
 # pypi
@@ -28,7 +27,22 @@ BOT_OAUTH_TOKEN = SLACK_CONFIG["bot_oauth_token"]
 
 BUTTON_CONFIG = config.get_and_verify_config_data("config/button.json")
 
-LAST_MESSAGE_TIMESTAMP = None
+class DeviceNotConfigured(Exception):
+    """
+    Raised when a device isn't listed in the Config tab
+    """
+
+# for turning Config tab headers into dict keys, e.g. "Rate Limit (seconds)" -> "rate_limit_seconds"
+HEADER_WHITESPACE = re.compile(r"\s+")
+HEADER_PARENTHESES = re.compile(r"[()]")
+
+# appended to every posted message
+MESSAGE_TRAILER = "\n*To respond, reply to this message in a thread within 3 minutes*\n*To resolve, react with :white_check_mark: or :+1:*"
+
+LAST_MESSAGE_TIMESTAMP = None # time.monotonic() of the last message we sent
+# the config rows the index was built from, and device id -> config dict
+# since get_region hands back the same list while it's cached, the index lives exactly as long
+DEVICE_INDEX = (None, {})
 
 def get_device_config(sheets_service, spreadsheet_id: int, device_id: str) -> dict[str, str]:
     """
@@ -46,33 +60,46 @@ def get_device_config(sheets_service, spreadsheet_id: int, device_id: str) -> di
 
     :return: the dictionary of column name -> config value
     :rtype: dict
+
+    :raises DeviceNotConfigured: if the device isn't listed in the Config tab
     """
+    global DEVICE_INDEX
+
     tsprint("Getting device config.")
 
-    last_row = sheets.find_first_empty_row(sheets_service, spreadsheet_id)
+    # open-ended, so we don't need to look up how many rows there are first
     all_rows = sheets.get_region(sheets_service, spreadsheet_id, tab_name="Config",
-                                        first_row = 1, last_row = last_row,
+                                        first_row = 1, last_row = None,
                                         first_letter = "A", last_letter = "J")
 
-    # put titles in device config dict in order
-    keys = []
-    for title in all_rows[0]:
-        title = title.lower().replace("#", "num")
-        title = re.sub(r"\s+", "_", title)
-        title = re.sub(r"\(|\)", "", title)
+    if DEVICE_INDEX[0] is not all_rows:
+        # put titles in device config dict in order
+        keys = []
+        for title in all_rows[0]:
+            title = title.lower().replace("#", "num")
+            title = HEADER_WHITESPACE.sub("_", title)
+            title = HEADER_PARENTHESES.sub("", title)
 
-        keys.append(title)
+            keys.append(title)
 
-    for row in all_rows[1:]:
-        if len(row) > 1 and row[1].strip() == device_id:
-            tsprint(f"Got device info: {row}")
-            # combine keys and row (device config)
-            device_config_dict = dict(zip(keys, row))
+        # combine keys and each row (device config), the first listing of a device wins
+        device_configs = {}
+        for row in all_rows[1:]:
+            if len(row) > 1:
+                device_configs.setdefault(row[1].strip(), dict(zip(keys, row)))
 
-            return device_config_dict
+        DEVICE_INDEX = (all_rows, device_configs)
+
+    device_config_dict = DEVICE_INDEX[1].get(device_id)
+    if device_config_dict is not None:
+        tsprint(f"Got device info: {device_config_dict}")
+        return device_config_dict
     
-    tsprint(f"ERROR: Unable to get device config. Device {device_id} was not listed. Exiting.")
-    exit(1)
+    # forget the rows, so the device is picked up as soon as it's added to the sheet
+    sheets.invalidate_region(spreadsheet_id, "Config")
+
+    tsprint(f"ERROR: Unable to get device config. Device {device_id} was not listed.")
+    raise DeviceNotConfigured(device_id)
 
 def handle_interaction(aws_client: boto3.client, sheets_service, spreadsheet_id, do_post: bool = True) -> dict | None:
     """
@@ -111,30 +138,18 @@ def handle_interaction(aws_client: boto3.client, sheets_service, spreadsheet_id,
     tsprint(f"Message retrieved from config: {final_message}")
 
     # handle long button presses by sending a test message
-    final_message += "\n*To respond, reply to this message in a thread within 3 minutes*\n*To resolve, react with :white_check_mark: or :+1:*"
+    final_message += MESSAGE_TRAILER
 
     # if we post to Slack, we need to go through AWS and return a message/channel id
     if do_post:
-        result_container = {}
-
-        def aws_worker():
-            global LAST_MESSAGE_TIMESTAMP
-            message_id, channel_id = aws.post_to_slack(
-                aws_client, final_message, device_channel_id, device_id, True
-            )
-            tsprint("Message posted to slack.")
-            
-            # store results for the caller
-            result_container["message_id"] = message_id
-            result_container["channel_id"] = channel_id
-
-        tsprint(f"Starting AWS worker thread to post message for device {device_id}")
-        thread = threading.Thread(target=aws_worker, daemon=True)
-        thread.start()
-        thread.join()  # wait for the thread to finish so we can return values
-        tsprint(f"AWS message posting finished for device {device_id}: message_id={result_container.get('message_id')} channel_id={result_container.get('channel_id')}")
-
-        return result_container.get("message_id"), result_container.get("channel_id")
+        # we're already off the GUI thread, so there's no need for another one
+        tsprint(f"Posting message for device {device_id}")
+        message_id, channel_id = aws.post_to_slack(
+            aws_client, final_message, device_channel_id, device_id, True
+        )
+        tsprint(f"AWS message posting finished for device {device_id}: message_id={message_id} channel_id={channel_id}")
+
+        return message_id, channel_id
     
     # else not needed here cuz return
     return None
\ No newline at end of file
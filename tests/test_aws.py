@@ -4,6 +4,7 @@ from pytest_mock import MockerFixture
 from pytest_mock import mocker
 import io
 import json
+import threading
 
 # my modules
 from src import aws
@@ -36,17 +37,69 @@ def test_post_to_slack(mocker: MockerFixture):
 	# assert that the client invokes "AWS" exactly once
 	mock_client.invoke.assert_called_once()
 
+	# assert that the pre-built payload is still valid JSON with our values filled in
+	called_kwargs = mock_client.invoke.call_args[1]
+	assert json.loads(called_kwargs["Payload"]) == {
+		"body": {
+			"type": "post",
+			"message": "test",
+			"channel_id": message_id,
+			"device_id": "Mock1"
+		}
+	}
+
+def test_post_to_slack_prod(mocker: MockerFixture):
+	# setup
+	mock_client = mocker.Mock()
+	mock_client.invoke.return_value = {
+		"Payload": io.BytesIO(json.dumps({
+			"posted_message_id": "123",
+			"posted_message_channel": "C999"
+		}).encode("utf-8"))
+	}
+
+	aws.post_to_slack(
+		mock_client,
+		"test",
+		"C999",
+		"Mock1",
+		dev=False
+	)
+
+	# assert that prod invokes the prod function, not the dev one (or an empty name)
+	called_kwargs = mock_client.invoke.call_args[1]
+	assert called_kwargs["FunctionName"] == "slackLambda"
+
+def test_post_to_slack_truthy_dev(mocker: MockerFixture):
+	# setup
+	mock_client = mocker.Mock()
+	mock_client.invoke.return_value = {
+		"Payload": io.BytesIO(json.dumps({
+			"posted_message_id": "123",
+			"posted_message_channel": "C999"
+		}).encode("utf-8"))
+	}
+
+	# dev can come from JSON config or elsewhere as any truthy value, not just True
+	aws.post_to_slack(
+		mock_client,
+		"test",
+		"C999",
+		"Mock1",
+		dev=1
+	)
+
+	called_kwargs = mock_client.invoke.call_args[1]
+	assert called_kwargs["FunctionName"] == "slackLambda-dev"
+
 def test_mark_message_timed_out(mocker: MockerFixture):
 	# setup
 	message_id = "123"
 	channel_id = "C999"
 	mock_client = mocker.Mock()
 	mock_client.invoke.return_value = {
-		"Payload": io.BytesIO(json.dumps({
-			"type": "message_timeout",
-			"posted_message_id": message_id,
-			"posted_message_channel": channel_id
-		}).encode("utf-8"))
+		"StatusCode": 202,
+		"Payload": io.BytesIO(b"")
 	}
 
 	# call the function with the mock client, to avoid actual API call
@@ -57,13 +110,14 @@ def test_mark_message_timed_out(mocker: MockerFixture):
 		True
 	)
 
-	# assert that we're returning the expected values
-	assert resp["type"] == "message_timeout"
-	assert resp["posted_message_id"] == message_id
-	assert resp["posted_message_channel"] == channel_id
+	# assert that we're returning the raw invoke response
+	assert resp["StatusCode"] == 202
 
-	# assert that the client invokes "AWS" exactly once
+	# assert that the client invokes "AWS" exactly once, without waiting on the result
 	mock_client.invoke.assert_called_once()
+	called_kwargs = mock_client.invoke.call_args[1]
+	assert called_kwargs["InvocationType"] == "Event"
+	assert json.loads(called_kwargs["Payload"])["body"]["message_id"] == message_id
 
 def test_mark_message_replied(mocker: MockerFixture):
 	# setup
@@ -71,11 +125,8 @@ def test_mark_message_replied(mocker: MockerFixture):
 	channel_id = "C999"
 	mock_client = mocker.Mock()
 	mock_client.invoke.return_value = {
-		"Payload": io.BytesIO(json.dumps({
-			"type": "message_timeout",
-			"posted_message_id": message_id,
-			"posted_message_channel": channel_id
-		}).encode("utf-8"))
+		"StatusCode": 202,
+		"Payload": io.BytesIO(b"")
 	}
 
 	# call the function with the mock client, to avoid actual API call
@@ -86,13 +137,14 @@ def test_mark_message_replied(mocker: MockerFixture):
 		True
 	)
 
-	# assert that we're returning the expected values
-	assert resp["type"] == "message_timeout"
-	assert resp["posted_message_id"] == message_id
-	assert resp["posted_message_channel"] == channel_id
+	# assert that we're returning the raw invoke response
+	assert resp["StatusCode"] == 202
 
-	# assert that the client invokes "AWS" exactly once
+	# assert that the client invokes "AWS" exactly once, without waiting on the result
 	mock_client.invoke.assert_called_once()
+	called_kwargs = mock_client.invoke.call_args[1]
+	assert called_kwargs["InvocationType"] == "Event"
+	assert json.loads(called_kwargs["Payload"])["body"]["message_id"] == message_id
 
 def test_poll_sqs(mocker: MockerFixture, capsys: pytest.CaptureFixture[str]):
 	mock_client = mocker.Mock()
@@ -108,18 +160,151 @@ def test_poll_sqs(mocker: MockerFixture, capsys: pytest.CaptureFixture[str]):
 		"ReceiptHandle": "RECEIPT123"
 	}
 
-	# set STOP_THREAD so poll_sqs exits after one loop
+	stop_event = threading.Event()
+
+	# set the stop event so poll_sqs exits after one loop
 	# also sets the return value
 	def receive_side_effect(*args, **kwargs):
-		aws.STOP_THREAD = True
+		stop_event.set()
 		return {"Messages": [sqs_message]}
 	
 	mock_client.receive_message.side_effect = receive_side_effect
+	mock_client.delete_message_batch.return_value = {}
 
-	aws.poll_sqs(mock_client, "Mock1")
+	aws.poll_sqs(mock_client, "Mock1", stop_event)
 	captured = capsys.readouterr()
 
 	assert f"] SQS message received: {message_dict}" in captured.out
-	mock_client.delete_message.assert_called_once()
-	called_kwargs = mock_client.delete_message.call_args[1]
-	assert called_kwargs["ReceiptHandle"] == "RECEIPT123"
\ No newline at end of file
+	assert aws.MESSAGE_QUEUE.get_nowait() == message_dict
+	mock_client.delete_message_batch.assert_called_once()
+	called_kwargs = mock_client.delete_message_batch.call_args[1]
+	assert called_kwargs["Entries"] == [{"Id": "0", "ReceiptHandle": "RECEIPT123"}]
+
+def test_poll_sqs_batch(mocker: MockerFixture):
+	mock_client = mocker.Mock()
+	message_dicts = [
+		{
+			"ts": f"1767897585.23311{i}",
+			"reply_text": f"test {i}",
+			"reply_author": "Nikki"
+		}
+		for i in range(3)
+	]
+
+	# several messages come back from a single receive
+	sqs_messages = [
+		{
+			"Body": json.dumps({"Message": json.dumps(message_dict)}),
+			"ReceiptHandle": f"RECEIPT{i}"
+		}
+		for i, message_dict in enumerate(message_dicts)
+	]
+
+	stop_event = threading.Event()
+
+	def receive_side_effect(*args, **kwargs):
+		stop_event.set()
+		return {"Messages": sqs_messages}
+
+	mock_client.receive_message.side_effect = receive_side_effect
+	mock_client.delete_message_batch.return_value = {}
+
+	aws.poll_sqs(mock_client, "Mock1", stop_event)
+
+	# assert that we asked for a full batch with a long poll
+	called_kwargs = mock_client.receive_message.call_args[1]
+	assert called_kwargs["MaxNumberOfMessages"] == 10
+	assert called_kwargs["WaitTimeSeconds"] == 20
+
+	# assert that every message was queued, in order
+	assert [aws.MESSAGE_QUEUE.get_nowait() for _ in message_dicts] == message_dicts
+
+	# assert that they were all deleted with a single call
+	mock_client.delete_message_batch.assert_called_once()
+	called_kwargs = mock_client.delete_message_batch.call_args[1]
+	assert called_kwargs["Entries"] == [
+		{"Id": str(i), "ReceiptHandle": f"RECEIPT{i}"}
+		for i in range(3)
+	]
+
+def test_poll_sqs_raw_delivery(mocker: MockerFixture, capsys: pytest.CaptureFixture[str]):
+	mock_client = mocker.Mock()
+	message_dict = {
+		"ts": "1767897585.233119",
+		"reply_text": "test",
+		"reply_author": "Nikki"
+	}
+
+	# with raw message delivery there's no SNS envelope around the message
+	sqs_message = {
+		"Body": json.dumps(message_dict),
+		"ReceiptHandle": "RECEIPT123"
+	}
+
+	stop_event = threading.Event()
+
+	def receive_side_effect(*args, **kwargs):
+		stop_event.set()
+		return {"Messages": [sqs_message]}
+
+	mock_client.receive_message.side_effect = receive_side_effect
+	mock_client.delete_message_batch.return_value = {}
+
+	on_message = mocker.Mock()
+
+	aws.poll_sqs(mock_client, "Mock1", stop_event, on_message)
+	captured = capsys.readouterr()
+
+	assert f"] SQS message received: {message_dict}" in captured.out
+	assert aws.MESSAGE_QUEUE.get_nowait() == message_dict
+	mock_client.delete_message_batch.assert_called_once()
+	on_message.assert_called_once_with()
+
+def test_poll_sqs_delete_failed(mocker: MockerFixture, capsys: pytest.CaptureFixture[str]):
+	mock_client = mocker.Mock()
+	message_dicts = [
+		{
+			"ts": f"1767897585.23311{i}",
+			"reply_text": f"test {i}",
+			"reply_author": "Nikki"
+		}
+		for i in range(2)
+	]
+
+	sqs_messages = [
+		{
+			"Body": json.dumps(message_dict),
+			"ReceiptHandle": f"RECEIPT{i}"
+		}
+		for i, message_dict in enumerate(message_dicts)
+	]
+
+	stop_event = threading.Event()
+
+	def receive_side_effect(*args, **kwargs):
+		stop_event.set()
+		return {"Messages": sqs_messages}
+
+	mock_client.receive_message.side_effect = receive_side_effect
+
+	# the second message fails to delete both times
+	failure = {"Id": "1", "SenderFault": False, "Code": "InternalError", "Message": "oops"}
+	mock_client.delete_message_batch.side_effect = [
+		{"Successful": [{"Id": "0"}], "Failed": [failure]},
+		{"Failed": [failure]}
+	]
+
+	aws.poll_sqs(mock_client, "Mock1", stop_event)
+	captured = capsys.readouterr()
+
+	# assert that only the failed message is retried
+	assert mock_client.delete_message_batch.call_count == 2
+	called_kwargs = mock_client.delete_message_batch.call_args[1]
+	assert called_kwargs["Entries"] == [{"Id": "1", "ReceiptHandle": "RECEIPT1"}]
+
+	# assert that the message that still couldn't be deleted is logged
+	assert "WARNING: Could not delete SQS message 1: InternalError oops" in captured.out
+
+	# clean up the queued messages for the other tests
+	for _ in message_dicts:
+		aws.MESSAGE_QUEUE.get_nowait()
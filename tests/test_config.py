@@ -0,0 +1,53 @@
+# built-in
+import os
+from pathlib import Path
+import pytest
+from pytest_mock import MockerFixture
+
+# my modules
+from src import config
+
+@pytest.fixture
+def config_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> str:
+	# a config and its defaults in a scratch directory, with nothing cached yet
+	monkeypatch.chdir(tmp_path)
+	monkeypatch.setattr(config, "CONFIG_CACHE", {})
+	config.get_config_defaults.cache_clear()
+
+	Path("config_defaults").mkdir()
+	Path("config_defaults", "test.json").write_bytes(b'{"key": ""}')
+	Path("config").mkdir()
+	Path("config", "test.json").write_bytes(b'{"key": "value", "nested": {"list": [1]}}')
+
+	yield "config/test.json"
+
+	config.get_config_defaults.cache_clear()
+
+def test_unchanged_config_not_reread(mocker: MockerFixture, config_path: str):
+	read_bytes = mocker.spy(Path, "read_bytes")
+
+	first = config.get_and_verify_config_data(config_path)
+	reads = read_bytes.call_count
+	second = config.get_and_verify_config_data(config_path)
+
+	# the second call only stats the file
+	assert read_bytes.call_count == reads
+	assert second == first == {"key": "value", "nested": {"list": [1]}}
+
+def test_changed_config_reloaded(config_path: str):
+	assert config.get_and_verify_config_data(config_path)["key"] == "value"
+
+	Path(config_path).write_bytes(b'{"key": "changed"}')
+	# make sure the mtime moves, even on filesystems with coarse timestamps
+	mtime = os.stat(config_path).st_mtime
+	os.utime(config_path, (mtime + 10, mtime + 10))
+
+	assert config.get_and_verify_config_data(config_path)["key"] == "changed"
+
+def test_returned_config_is_a_copy(config_path: str):
+	first = config.get_and_verify_config_data(config_path)
+	first["key"] = "mutated"
+	first["nested"]["list"].append(2)
+
+	# one caller's changes don't show up for the next
+	assert config.get_and_verify_config_data(config_path) == {"key": "value", "nested": {"list": [1]}}
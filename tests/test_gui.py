@@ -0,0 +1,39 @@
+# built-in
+import importlib
+import sys
+import pytest
+from pytest_mock import MockerFixture
+
+@pytest.fixture
+def gui(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch):
+	# the slack module sets up AWS from the config files on import, which
+	# we don't have (or want) here, so the GUI gets a mock in its place
+	monkeypatch.setitem(sys.modules, "src.slack", mocker.MagicMock())
+	monkeypatch.delitem(sys.modules, "src.gui", raising=False)
+
+	return importlib.import_module("src.gui")
+
+@pytest.mark.parametrize("reply_text, expected", [
+	# reactions come through as bare names
+	("white_check_mark", True),
+	("+1", True),
+	("+1::skin-tone-2", True),
+	("heavy_check_mark", False),
+	("thumbsup", False),
+
+	# replies have to use the emoji itself
+	(":+1:", True),
+	(":white_check_mark:", True),
+	(":+1::skin-tone-2:", True),
+	("thanks :white_check_mark:", True),
+	("on it :+1: will update", True),
+
+	# but not just contain the emoji's name
+	("ok: +1", False),
+	("x+1", False),
+	("+1 from me", False),
+	(":heavy_check_mark:", False),
+	("", False),
+])
+def test_is_resolution(gui, reply_text: str, expected: bool):
+	assert gui.is_resolution(reply_text) is expected
@@ -0,0 +1,116 @@
+# built-in
+import threading
+import time
+import pytest
+from pytest_mock import MockerFixture
+from google.oauth2.credentials import Credentials
+
+# my modules
+from src import sheets
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch: pytest.MonkeyPatch):
+	# every test gets its own cache, so nothing leaks between them
+	monkeypatch.setattr(sheets, "CACHE", {})
+
+def mock_append(mocker: MockerFixture, result: dict):
+	mock_service = mocker.Mock()
+	mock_service.spreadsheets().values().append().execute.return_value = result
+	return mock_service
+
+def test_add_rows(mocker: MockerFixture):
+	# setup
+	mock_service = mock_append(mocker, {"updates": {"updatedRange": "'Logs'!A5:C6", "updatedCells": 6}})
+	spreadsheet_cache = sheets.get_spreadsheet_cache("sheet")
+	sheets.set_cached(spreadsheet_cache["regions"], "Logs", {"'Logs'!A1:C4": []})
+
+	sheets.add_rows(mock_service, "sheet", [["a", "b", "c"], ["d", "e", "f"]], "Logs")
+
+	# the row after the last one written is the first empty one
+	assert sheets.get_cached(spreadsheet_cache["first_empty_row"], "Logs") == 7
+	assert sheets.get_cached(spreadsheet_cache["emptiness"], "Logs") is False
+	assert "Logs" not in spreadsheet_cache["regions"]
+
+def test_add_rows_no_updated_range(mocker: MockerFixture):
+	# setup
+	mock_service = mock_append(mocker, {})
+	spreadsheet_cache = sheets.get_spreadsheet_cache("sheet")
+	sheets.set_cached(spreadsheet_cache["first_empty_row"], "Logs", 5)
+	sheets.set_cached(spreadsheet_cache["regions"], "Logs", {"'Logs'!A1:C4": []})
+
+	# shouldn't raise, even though we can't tell where the rows went
+	sheets.add_rows(mock_service, "sheet", [["a", "b", "c"]], "Logs")
+
+	# so the stale first empty row is dropped, and the regions still go
+	assert sheets.get_cached(spreadsheet_cache["first_empty_row"], "Logs") is None
+	assert "Logs" not in spreadsheet_cache["regions"]
+
+def test_row_batcher_max_rows(mocker: MockerFixture):
+	# setup
+	written = threading.Event()
+	mock_add_rows = mocker.patch("src.sheets.add_rows", side_effect=lambda *args: written.set())
+
+	# a long interval, so only hitting max_rows can flush in time
+	batcher = sheets.RowBatcher("service", "sheet", "Logs", max_rows=10, flush_interval=60)
+	for i in range(10):
+		batcher.add([str(i)])
+
+	assert written.wait(5)
+	mock_add_rows.assert_called_once_with("service", "sheet", [[str(i)] for i in range(10)], "Logs")
+
+def test_row_batcher_flush_interval(mocker: MockerFixture):
+	# setup
+	written = threading.Event()
+	mock_add_rows = mocker.patch("src.sheets.add_rows", side_effect=lambda *args: written.set())
+
+	batcher = sheets.RowBatcher("service", "sheet", "Logs", max_rows=10, flush_interval=0.2)
+	start = time.monotonic()
+	batcher.add(["a"])
+	batcher.add(["b"])
+
+	# too few rows to fill a batch, so they go out once the interval's up
+	assert written.wait(5)
+	assert time.monotonic() - start >= 0.2
+	mock_add_rows.assert_called_once_with("service", "sheet", [["a"], ["b"]], "Logs")
+
+def test_row_batcher_flush_failed(mocker: MockerFixture):
+	# setup
+	mock_add_rows = mocker.patch("src.sheets.add_rows", side_effect=RuntimeError("quota exceeded"))
+	mock_tsprint = mocker.patch("src.sheets.tsprint")
+
+	batcher = sheets.RowBatcher("service", "sheet", "Logs", flush_interval=60)
+	batcher.add(["a"])
+
+	# the failure is logged instead of raised, and the rows aren't kept around
+	batcher.flush()
+
+	mock_add_rows.assert_called_once()
+	assert "Could not write 1 row(s) to tab Logs" in mock_tsprint.call_args.args[0]
+	assert batcher.rows == []
+
+def test_requests_use_thread_http(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch):
+	# setup, building the service for real, it doesn't need the network
+	creds = Credentials(token="token")
+	mocker.patch("src.sheets.do_oauth_flow", return_value=creds)
+	mocker.patch("src.sheets.config.get_and_verify_config_data", return_value={"id": "sheet"})
+	mocker.patch("src.sheets.get_spreadsheet")
+	monkeypatch.setattr(sheets, "SERVICE", None)
+	monkeypatch.setattr(sheets, "SERVICE_CREDS", None)
+	monkeypatch.setattr(sheets, "THREAD_HTTP", threading.local())
+
+	_, sheets_service, _, _, _ = sheets.setup_sheets()
+
+	def request_http():
+		return sheets_service.spreadsheets().get(spreadsheetId="sheet").http
+
+	# one connection per thread, reused by that thread's later requests
+	main_http = request_http()
+	assert request_http() is main_http
+
+	other_https = []
+	thread = threading.Thread(target=lambda: other_https.append(request_http()))
+	thread.start()
+	thread.join()
+
+	assert other_https[0] is not main_http
+	assert other_https[0].credentials is creds
@@ -0,0 +1,51 @@
+# built-in
+import importlib
+import sys
+import pytest
+from pytest_mock import MockerFixture
+
+HEADERS = ["Device Name", "Device ID", "Rate Limit (seconds)"]
+
+@pytest.fixture
+def slack(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch):
+	# the slack module sets up AWS and reads its configs on import,
+	# which we don't have (or want) here
+	mocker.patch("src.aws.setup_aws", return_value=(mocker.Mock(), mocker.Mock()))
+	mocker.patch("src.config.get_and_verify_config_data", return_value={"bot_oauth_token": "token"})
+	monkeypatch.delitem(sys.modules, "src.slack", raising=False)
+
+	return importlib.import_module("src.slack")
+
+def test_get_device_config(mocker: MockerFixture, slack):
+	# setup
+	mocker.patch("src.sheets.get_region", return_value=[
+		HEADERS,
+		["Front Desk", "desk1", "30"],
+		["Lab", " lab1 ", "60"]
+	])
+
+	device_config = slack.get_device_config("service", "sheet", "lab1")
+
+	assert device_config == {"device_name": "Lab", "device_id": " lab1 ", "rate_limit_seconds": "60"}
+
+def test_get_device_config_missing(mocker: MockerFixture, slack):
+	# setup
+	mocker.patch("src.sheets.get_region", return_value=[HEADERS, ["Front Desk", "desk1", "30"]])
+	mock_invalidate = mocker.patch("src.sheets.invalidate_region")
+
+	with pytest.raises(slack.DeviceNotConfigured):
+		slack.get_device_config("service", "sheet", "lab1")
+
+	# so a device that's just been added is picked up on the next try
+	mock_invalidate.assert_called_once_with("sheet", "Config")
+
+def test_get_device_config_duplicate(mocker: MockerFixture, slack):
+	# setup
+	mocker.patch("src.sheets.get_region", return_value=[
+		HEADERS,
+		["Front Desk", "desk1", "30"],
+		["Old Front Desk", "desk1", "90"]
+	])
+
+	# the first listing of a device wins
+	assert slack.get_device_config("service", "sheet", "desk1")["device_name"] == "Front Desk"